@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+'''Synthetic inputs of the given size (in characters, at least one
+item is generated) for the example grammars. Inputs are the same for
+the same size, so results of different runs can be compared'''
+
+import codecs
+import glob
+import os
+import random
+
+examples = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'examples')
+
+def repeated(head, items, tail, size):
+    parts = [head]
+    length = len(head) + len(tail)
+    i = 0
+    while i == 0 or length < size:
+        item = items[i % len(items)]
+        parts.append(item)
+        length += len(item)
+        i += 1
+    parts.append(tail)
+    return ''.join(parts)
+
+def xml(size):
+    '''svg elements from examples/media wrapped into the root element'''
+    items = []
+    for path in sorted(glob.glob(os.path.join(examples, 'media', '*.svg'))):
+        with codecs.open(path, encoding = 'utf-8') as f:
+            text = f.read()
+        items.append(text[text.index(u'<svg'):].strip() + u'\n')
+    return repeated(u'<?xml version="1.0" encoding="UTF-8"?>\n<bench>\n',
+                    items, u'</bench>\n', size)
+
+def vcard(size):
+    '''vcard with tags of the examples/vcard.py card repeated'''
+    import vcard
+    card = vcard.vc
+    begin = card.index('VERSION:')
+    end = card.index('END:VCARD')
+    return repeated(card[:begin], [card[begin:end]], card[end:], size)
+
+def sexp(size, seed = 1):
+    '''list of random s-expressions'''
+    rnd = random.Random(seed)
+    atoms = ['12', '-7', '#ff', '3.25', '.5', 'name', 'a-b/c', ':key',
+             "'sym", '"quoted string"', '10~px']
+
+    def expr(depth):
+        if depth > 4 or rnd.random() < 0.6:
+            return rnd.choice(atoms)
+        items = [expr(depth + 1) for i in xrange(rnd.randint(1, 5))]
+        return ''.join(['(', ' '.join(items), ')'])
+
+    items = []
+    for i in xrange(64):
+        item = expr(0)
+        if i % 8 == 0:
+            item = ''.join([';comment ', str(i), '\n ', item])
+        items.append(' ' + item)
+    return repeated('(', items, ')', size)
+
+generators = {
+    'xml': xml,
+    'vcard': vcard,
+    'sexp': sexp,
+}
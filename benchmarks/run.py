@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+'''Benchmark of the example grammars on synthetic inputs. Each case
+(grammar, input size, parser mode) is run in its own process to
+measure its peak memory. Results are written as JSON:
+
+        python benchmarks/run.py --sizes 1K,1M --output base.json
+        ...
+        python benchmarks/run.py --sizes 1K,1M --compare base.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path[:0] = [os.path.abspath(root), os.path.join(root, 'examples')]
+
+import parsed
+from parsed import *
+from parsed.Rules import CachingRule
+import inputs
+
+modes = {
+    'memo': lambda: mk_options(),
+    'nomemo': lambda: mk_options(is_remember = False),
+    'trace': lambda: mk_options(is_trace = trace(1000)),
+    'stat': lambda: mk_options(is_stat = True),
+}
+
+def xml_parser(options):
+    import xml_parser
+    return xml_parser.xml_parser(xml_parser.xml_gen, options)
+
+def vcard_parser(options):
+    import vcard
+    return vcard.grammar(vcard.VCardCtx(), options)
+
+def sexp_parser(options):
+    import sexp
+    cache_clean(vars(sexp))
+    return sexp.sexp(options)
+
+#grammar name -> (parser builder, is input unicode)
+grammars = {
+    'xml': (xml_parser, True),
+    'vcard': (vcard_parser, False),
+    'sexp': (sexp_parser, False),
+}
+
+units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+def parse_size(s):
+    s = s.strip().upper().rstrip('B')
+    if s and s[-1] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s)
+
+def peak_rss():
+    '''peak resident memory of the process, KB'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_case(grammar, size, mode, repeat):
+    '''measures the case in the current process'''
+    mk_parser, is_unicode = grammars[grammar]
+    options = modes[mode]()
+    options.use_unicode = is_unicode
+    import_rss = peak_rss()
+    #parsers of predefined rules are cached too
+    cache_clean(vars(parsed))
+    begin = time.time()
+    p = mk_parser(options)
+    build = time.time() - begin
+
+    src = inputs.generators[grammar](size)
+    length = len(src.encode('utf-8') if is_unicode else src)
+    base_rss = peak_rss()
+    times = []
+    for i in xrange(repeat):
+        begin = time.time()
+        pos, value = p.parse(src)
+        times.append(time.time() - begin)
+    memo = CachingRule._memo
+    best = min(times)
+    return dict(grammar = grammar, mode = mode, size = size,
+                input_bytes = length, is_matched = value != nomatch,
+                consumed = pos, build_s = build, parse_s = best,
+                parse_all_s = times,
+                throughput_mbps = length / best / (1 << 20) if best else None,
+                import_rss_kb = import_rss, base_rss_kb = base_rss,
+                peak_rss_kb = peak_rss(), memo_entries = memo.entries,
+                memo_bytes = memo.size)
+
+def run_isolated(grammar, size, mode, repeat):
+    cmd = [sys.executable, os.path.abspath(__file__), '--case',
+           grammar, str(size), mode, '--repeat', str(repeat)]
+    proc = subprocess.Popen(cmd, stdout = subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode:
+        return dict(grammar = grammar, mode = mode, size = size,
+                    error = proc.returncode)
+    return json.loads(out)
+
+def case_key(x):
+    return (x['grammar'], x['size'], x['mode'])
+
+def compare(results, path):
+    with open(path) as f:
+        base = dict((case_key(x), x) for x in json.load(f)['cases'])
+    lines = []
+    for x in results:
+        old = base.get(case_key(x))
+        if old is None or 'error' in x or 'error' in old:
+            continue
+        lines.append('{:6} {:>10} {:7} parse {:8.3f}x build {:8.3f}x '
+                     'peak {:8.3f}x'.format(
+                         x['grammar'], x['size'], x['mode'],
+                         x['parse_s'] / old['parse_s'],
+                         x['build_s'] / old['build_s'],
+                         float(x['peak_rss_kb']) / old['peak_rss_kb']))
+    return '\n'.join(lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('--sizes', default = '1K,100K,1M',
+                        help = 'input sizes, e.g. 1K,10M,100M')
+    parser.add_argument('--grammars', default = ','.join(sorted(grammars)))
+    parser.add_argument('--modes', default = 'memo,nomemo,trace,stat')
+    parser.add_argument('--repeat', type = int, default = 3,
+                        help = 'parses of each input, the best is reported')
+    parser.add_argument('--output', help = 'JSON file, stdout by default')
+    parser.add_argument('--compare', help = 'JSON file of the previous run')
+    parser.add_argument('--case', nargs = 3,
+                        metavar = ('GRAMMAR', 'SIZE', 'MODE'),
+                        help = 'run one case in this process')
+    args = parser.parse_args(argv)
+
+    if args.case:
+        grammar, size, mode = args.case
+        json.dump(run_case(grammar, int(size), mode, args.repeat), sys.stdout)
+        return 0
+
+    results = []
+    for grammar in args.grammars.split(','):
+        for size in [parse_size(x) for x in args.sizes.split(',')]:
+            for mode in args.modes.split(','):
+                res = run_isolated(grammar, size, mode, args.repeat)
+                sys.stderr.write('{} {} {}: {}\n'.format(
+                    grammar, size, mode, 'error' if 'error' in res
+                    else '{:.3f}s'.format(res['parse_s'])))
+                results.append(res)
+    report = dict(python = sys.version, platform = platform.platform(),
+                  time = time.strftime('%Y-%m-%dT%H:%M:%S'), cases = results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 1, sort_keys = True)
+    else:
+        json.dump(report, sys.stdout, indent = 1, sort_keys = True)
+        sys.stdout.write('\n')
+    if args.compare:
+        sys.stderr.write(compare(results, args.compare) + '\n')
+    return 1 if any('error' in x for x in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
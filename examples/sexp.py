@@ -68,9 +68,10 @@ def alist(): return '(' + list_item[1:] + spaces + ')' > first
 def sexp(): return comment | alist | atom > value
 
 
-#default_options.is_trace = True
-# cache_clean(globals())
+if __name__ == '__main__':
+    #default_options.is_trace = True
+    # cache_clean(globals())
 
-p = sexp(mk_options(is_trace = True))
-s = source('(1 2;er\n#f "dd")')
-print p.parse(s)
+    p = sexp(mk_options(is_trace = True))
+    s = source('(1 2;er\n#f "dd")')
+    print p.parse(s)
@@ -66,7 +66,7 @@ def grammar(ctx, options = mk_options(is_trace = False)):
 
     @rule
     def text_begin():
-        return (~crlf + any_char > first)[1:] + crlf > str_from(0)
+        return capture((~crlf + any_char)[1:]) + crlf > first
 
     @rule
     def text_continue():
@@ -101,7 +101,8 @@ def grammar(ctx, options = mk_options(is_trace = False)):
 
     @rule
     def vcard():
-        return wrap('BEGIN', 'VCARD') + tags + wrap('END', 'VCARD') + eol \
+        return wrap('BEGIN', 'VCARD') + cut + tags + wrap('END', 'VCARD') \
+            + eol \
             > (lambda x: ctx.vcard(x[0]))
 
     return vcard(options)
@@ -174,8 +175,9 @@ def foo():
     print s.dt, CachingRule._cache_hits
     print value
 
-foo()
-import cProfile
-#cProfile.run('foo()')
+if __name__ == '__main__':
+    foo()
+    import cProfile
+    #cProfile.run('foo()')
 
 #g.cache_clear()
\ No newline at end of file
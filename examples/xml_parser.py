@@ -33,8 +33,8 @@ def xml_parser(ctx, options = mk_options()):
             (lambda x: ctx.name(''.join([x[0], list2str(x[1])])))
 
     @rule
-    def attr_value(): return '"' + (~char('"') + any_char > first)[0:] + '"' \
-        > (lambda x: list2str(x[0]))
+    def attr_value(): return '"' + capture((~char('"') + any_char)[0:]) \
+        + '"' > first
     @rule
     def attribute():
         return spaces + name + spaces + '=' + spaces \
@@ -50,17 +50,17 @@ def xml_parser(ctx, options = mk_options()):
     @rule
     def element(): return spaces + (empty_elem | n_empty_elem) + spaces > first
     @rule
-    def xml_text(): return spaces + (~char('<') + any_char > first)[1:] \
-        > str_from(0)
+    def xml_text(): return spaces + capture((~char('<') + any_char)[1:]) \
+        > first
     @rule
     def child(): return element | comment | xml_text
 
     @rule
     def comment():
         return spaces + (text('<!--') > ignore) \
-            + (~text('-->') + any_char > first)[0:] \
+            + capture((~text('-->') + any_char)[0:]) \
             + (text('-->') > ignore) \
-            > (lambda x: ctx.comment(list2str(x[0])))
+            > (lambda x: ctx.comment(x[0]))
     @rule
     def n_empty_elem(): return stag + child[0:] + etag > \
         (lambda x: ctx.element_close(*x))
@@ -186,46 +186,40 @@ xml_gen = prop_map('xmlgen',
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        log("Call {} <svg file path>\n", sys.argv[0])
+    #bytes mode parses memory mapped file, names should be ascii
+    flags = sys.argv[1:-1]
+    is_bytes = '--bytes' in flags
+    is_profile = '--profile' in flags
+    if len(sys.argv) < 2 or set(flags) - set(['--bytes', '--profile']):
+        log("Call {} [--bytes] [--profile] <svg file path>\n", sys.argv[0])
         exit(1)
 
     def example():
         import parsed.cor as cor
         sw = cor.Stopwatch()
+        prof = profile() if is_profile else False
         options = mk_options(is_trace = False,
                              is_remember = True,
-                             use_unicode = True,
-                             is_stat = False)
+                             use_unicode = not is_bytes,
+                             use_bytes = is_bytes,
+                             is_stat = prof)
         p = xml_parser(xml_gen, options)
         print sw.dt
 
 
         from parsed.Rules import CachingRule
 
-        with codecs.open(sys.argv[1], encoding = 'utf-8') as f:
-            s = u'\n'.join(f.readlines())
+        if is_bytes:
+            s = mapped(sys.argv[-1])
+        else:
+            with codecs.open(sys.argv[-1], encoding = 'utf-8') as f:
+                s = u'\n'.join(f.readlines())
 
         sw.reset()
         pos, value = p.parse(s)
         print sw.dt, CachingRule._cache_hits
-        if options.is_stat:
-            def flat_stat(src):
-                stat = []
-                if src is None:
-                    return None
-                info, children = src
-                if isinstance(info, tuple):
-                    stat.append(info)
-                if cor.is_iterable(children):
-                    for x in children:
-                        res = flat_stat(x)
-                        if not res is None:
-                            stat += res
-                return stat
-            stat = flat_stat(p.stat)
-            stat = sorted(stat, key = lambda x: x[1].misses)
-            print '\n'.join([repr(x) for x in stat])
+        if prof:
+            print prof.report(30)
         #print value
 
     import cProfile
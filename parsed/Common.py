@@ -18,12 +18,58 @@ third = nth(2)
 def list2str(x): return ''.join(x)
 def str_from(idx): return lambda x: list2str(x[idx])
 
+class Node(object):
+    '''Parse tree node built by node() rule: name, tuple of children
+    values and (begin, end) span of the source it is parsed from'''
+
+    __slots__ = ('name', 'children', 'begin', 'end')
+
+    def __init__(self, name, children, begin, end):
+        self.name = name
+        self.children = children
+        self.begin = begin
+        self.end = end
+
+    @staticmethod
+    def of(name, value, begin, end):
+        '''node with items of the rule value list as children'''
+        if isinstance(value, list):
+            children = tuple(value)
+        elif value == empty:
+            children = ()
+        else:
+            children = (value,)
+        return Node(name, children, begin, end)
+
+    @property
+    def span(self):
+        return (self.begin, self.end)
+
+    def __eq__(self, other):
+        if not isinstance(other, Node):
+            return NotImplemented
+        return (self.name, self.children, self.begin, self.end) \
+            == (other.name, other.children, other.begin, other.end)
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        return res if res is NotImplemented else not res
+
+    def __repr__(self):
+        return 'Node({!r}, {!r}, {}, {})'.format(self.name, self.children,
+                                                 self.begin, self.end)
+
 def is_str(c):
     return isinstance(c, str) or isinstance(c, unicode) or c == empty
 
 def mk_options(**kwargs):
     res = Options(is_trace = False, is_remember = True,
-                  use_unicode = False, is_stat = False)
+                  use_unicode = False, is_stat = False,
+                  memo = 'unbounded', memo_limit = None,
+                  memo_select = 'all', is_stream = False,
+                  is_commit = False, is_incremental = False,
+                  use_regex = True, use_bytes = False,
+                  is_deferred = False)
     res.update(kwargs)
     return res
 
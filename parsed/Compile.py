@@ -0,0 +1,690 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+'''Grammar compiler: translates rule graph into the python module
+source with one plain function per rule.
+
+Generated module does not depend on the grammar module and can be
+imported without rebuilding the grammar. Semantic actions and
+predicates are referenced by import path if possible, otherwise their
+code is embedded as marshalled code objects. Closure variables which
+can't be embedded (e.g. context object passed to the grammar
+constructor) should be supplied when module is loaded:
+
+        from parsed import Compile
+        Compile.write(grammar_rule, 'grammar_gen.py', options)
+        ...
+        p = Compile.load('grammar_gen.py', ctx = MyContext())
+        pos, value = p.parse(src)
+
+Objects defined in the module of the top grammar rule (e.g. context
+object with actions) are referenced by import path as well. Parser
+built by rule(options) can be passed instead of the rule. Module can
+also be saved by dump() as the marshalled code which is loaded by
+load() faster because it is not parsed and compiled again.
+
+Memo of the generated module is kept until the next parse, bounded
+memo policies are not supported.
+'''
+
+import dis
+import imp
+import importlib
+import marshal
+import sys
+import types
+
+import Generate
+import Memo
+import Rules
+from cor import Err, integers, is_function
+from Common import *
+
+class Emitter(object):
+
+    literal_types = (type(None), bool, int, long, float, str, unicode)
+    search_modules = ('parsed.Common', 'parsed.cor', 'parsed')
+
+    def __init__(self, options, modules = ()):
+        if options.is_trace or options.is_stat:
+            raise Err("Tracing and statistics are not supported by compiler")
+        if options.is_stream:
+            raise Err("Streaming is not supported by compiler")
+        if options.is_deferred:
+            raise Err("Deferred actions are not supported by compiler")
+        if options.is_incremental:
+            raise Err("Incremental parsing is not supported by compiler")
+        if options.is_remember \
+           and Memo.policies.get(options.memo, options.memo) is not Memo.Dense:
+            #generated module memo is the plain dictionary
+            raise Err("Memo policy {} is not supported by compiler",
+                      options.memo)
+        self.options = options
+        self.search_modules = tuple(modules) + self.search_modules
+        self.__ids = integers()
+        self.__functions = {}
+        self.__pending = []
+        self.__objects = {}
+        self.__keep = []
+        self.env = []
+        self.bind_lines = []
+        self.rule_lines = []
+        self.memos = []
+        self.selection = None
+        self.committing = set()
+
+    def __next_name(self, prefix):
+        return ''.join([prefix, str(self.__ids.next())])
+
+    def function(self, grammar):
+        '''name of generated function matching grammar rule'''
+        seen = set()
+        while isinstance(grammar, Generate.TopRule):
+            if id(grammar) in seen:
+                raise Err("Rule {} is defined as itself", grammar.name)
+            seen.add(id(grammar))
+            grammar = grammar.expand()
+        key = id(grammar)
+        if key not in self.__functions:
+            self.__keep.append(grammar)
+            self.__functions[key] = self.__next_name('r')
+            self.__pending.append(grammar)
+        return self.__functions[key]
+
+    def emit_all(self, top):
+        if self.options.memo_select == 'auto':
+            self.selection = Generate.MemoSelection(top).selected
+        self.committing = Generate.committing(top)
+        res = self.function(top)
+        while self.__pending:
+            grammar = self.__pending.pop(0)
+            self.__emit_rule(grammar)
+        return res
+
+    def __locate(self, obj):
+        if isinstance(obj, types.ModuleType):
+            return obj.__name__, None
+        mod_names = [getattr(obj, '__module__', None)]
+        mod_names += list(self.search_modules)
+        name = getattr(obj, '__name__', None)
+        for mod_name in mod_names:
+            mod = sys.modules.get(mod_name) if mod_name else None
+            if mod is None or mod_name == '__main__':
+                continue
+            if name and getattr(mod, name, None) is obj:
+                return mod_name, name
+            for k, v in vars(mod).items():
+                if v is obj:
+                    return mod_name, k
+        return None
+
+    def literal(self, obj):
+        if type(obj) in self.literal_types:
+            return repr(obj)
+        if type(obj) in (tuple, list):
+            items = [self.literal(x) for x in obj]
+            if None in items:
+                return None
+            return ''.join(['(', ', '.join(items), ',)' if items else ')'])
+        return None
+
+    def ref(self, obj, hint = None):
+        '''python expression evaluating to obj in generated module'''
+        res = self.literal(obj)
+        if res is not None:
+            return res
+        key = id(obj)
+        if key in self.__objects:
+            return self.__objects[key]
+        self.__keep.append(obj)
+        name = self.__next_name('a')
+        self.__objects[key] = name
+        location = self.__locate(obj)
+        if location:
+            expr = '_compile.attr({}, {})'.format(*[repr(x) for x in location])
+        elif is_function(obj):
+            expr = self.__function_expr(obj)
+        elif hint:
+            expr = self.__env_expr(hint)
+        else:
+            raise Err("Can't reference {}", obj)
+        self.bind_lines.append('{} = {}'.format(name, expr))
+        return name
+
+    def __env_expr(self, hint):
+        name = hint
+        if name in self.env:
+            name = '_'.join([hint, str(len(self.env))])
+        self.env.append(name)
+        return '_env[{}]'.format(repr(name))
+
+    def __function_expr(self, fn):
+        code = fn.func_code
+        fn_globals = fn.func_globals
+        env = ['{}: {}'.format(repr(k), self.ref(fn_globals[k], k)) \
+               for k in sorted(global_names(code)) if k in fn_globals]
+        cells = []
+        for name, cell in zip(code.co_freevars, fn.func_closure or ()):
+            try:
+                v = cell.cell_contents
+            except ValueError:
+                raise Err("{}: closure variable {} is not set", fn, name)
+            cells.append(self.ref(v, name))
+        defaults = [self.ref(v) for v in fn.func_defaults or ()]
+        args = [repr(marshal.dumps(code)), ''.join(['{', ', '.join(env), '}']),
+                repr(fn.__name__),
+                ''.join(['(', ''.join([x + ', ' for x in defaults]), ')']),
+                ''.join(['(', ''.join([x + ', ' for x in cells]), ')'])]
+        return '_compile.function({})'.format(', '.join(args))
+
+    def __emit_rule(self, grammar):
+        name = self.__functions[id(grammar)]
+        kind = self.kinds.get(grammar.__class__)
+        if kind is None:
+            raise Err("Don't know how to compile {}", grammar)
+        is_char = isinstance(grammar, (Generate.FirstEqualRule,
+                                       Generate.FirstEqualRangeRule)) \
+                  or isinstance(grammar, Generate.ChoiceRule) \
+                  and grammar.chars is not None
+        #memo hit would skip the cut, as in the parser built by rule
+        is_memo = self.options.is_remember and not is_char \
+                  and (self.selection is None or grammar in self.selection) \
+                  and grammar not in self.committing
+        memo = self.__next_name('m') if is_memo else None
+        if memo:
+            self.memos.append(memo)
+        out = self.rule_lines
+        out.append('')
+        out.append('# {!r}'.format(grammar.name))
+        out.append('def {}(src, spos):'.format(name))
+        if memo:
+            out.append('    res = {}.get(spos)'.format(memo))
+            out.append('    if res is not None:')
+            out.append('        return res')
+        body = Body(memo)
+        kind(self, grammar, self.ref(grammar.action, 'action'), body)
+        out.extend(body.lines)
+
+    def _seq(self, grammar, action, out):
+        out.add('total = []')
+        out.add('pos = spos')
+        for test in grammar.rules:
+            out.call(self.function(test), 'pos', '_nomatch_res')
+            out.add('if value == nomatch:')
+            out.ret('_nomatch_res', 1)
+            out.add('if value != empty:')
+            out.add('total.append(value)', 1)
+            out.add('pos += dpos')
+        out.add('res = {}(total)'.format(action))
+        out.ret('(pos - spos, res) if res != nomatch else _nomatch_res')
+
+    def _choice(self, grammar, action, out):
+        if grammar.chars is not None:
+            return self.__char_class(grammar.chars, action, out)
+        if grammar.literals is not None:
+            return self.__literals(grammar.literals, action, out)
+        firsts = grammar.firsts_of(self.options)
+        if firsts is None:
+            firsts = [None] * len(grammar.rules)
+        else:
+            out.add('code = None')
+            out.add('if spos < len(src):')
+            out.add('try:', 1)
+            out.add('code = ord(src[spos])', 2)
+            out.add('except TypeError:', 1)
+            out.add('pass', 2)
+        is_commit = grammar in self.committing
+        for test, chars in zip(grammar.rules, firsts):
+            level = 0
+            if chars is not None:
+                out.add('if code is None or {}.has_code(code):'
+                        .format(self.__bind_char_class(chars)))
+                level = 1
+            if is_commit:
+                out.add('cuts = _cuts[0]', level)
+            out.add('try:', level)
+            out.add('dpos, value = {}(src, spos)'.format(self.function(test)),
+                    level + 1)
+            out.add('except IndexError:', level)
+            if is_commit:
+                self.__committed(out, level + 1)
+            out.ret('_nomatch_res', level + 1)
+            if is_commit:
+                out.add('if value == nomatch:', level)
+                self.__committed(out, level + 1)
+            out.add('if value != nomatch:', level)
+            out.add('value = {}(value)'.format(action), level + 1)
+            out.add('if value != nomatch:', level + 1)
+            out.ret('(dpos, value)', level + 2)
+        out.ret('_nomatch_res')
+
+    def __literals(self, rules, action, out):
+        items = [(self.__str(x.data), x.is_ignore_case) for x in rules]
+        actions = [self.ref(x.action, 'action') for x in rules]
+        literals, choices = self.__next_name('t'), self.__next_name('a')
+        self.bind_lines.append('{} = _compile.literals({})'
+                               .format(literals, self.literal(items)))
+        self.bind_lines.append('{} = ({},)'.format(choices, ', '.join(actions)))
+        out.add('v = _compile.as_text(src[spos:spos + {}])'
+                .format(max(len(s) for s, is_ignore_case in items)))
+        out.add('if isinstance(v, basestring):')
+        out.add('for i, n in {}.find(v):'.format(literals), 1)
+        out.add('value = {}[i](v[:n])'.format(choices), 2)
+        out.add('if value != nomatch:', 2)
+        out.add('value = {}(value)'.format(action), 3)
+        out.add('if value != nomatch:', 3)
+        out.ret('(n, value)', 4)
+        out.ret('_nomatch_res')
+
+    def __committed(self, out, level = 0):
+        '''rule failed after passing the cut, parser can't backtrack'''
+        out.add('if _cuts[0] != cuts:', level)
+        out.add('raise _compile.Committed()', level + 1)
+
+    def __call(self, grammar, test, pos, out, level = 0):
+        '''calls backtrack point test of the rule'''
+        is_commit = grammar in self.committing
+        if is_commit:
+            out.add('cuts = _cuts[0]', level)
+        out.call(test, pos, '_nomatch_res', level)
+        if is_commit:
+            out.add('if value == nomatch:', level)
+            self.__committed(out, level + 1)
+
+    def __isolated_call(self, grammar, test, out):
+        '''calls predicate test of the rule, cut passed by the test
+        affects only the test'''
+        if grammar not in self.committing:
+            return out.call(test, 'spos', '_nomatch_res')
+        out.add('cuts = _cuts[0]')
+        out.add('try:')
+        out.add('dpos, value = {}(src, spos)'.format(test), 1)
+        out.add('except (IndexError, _compile.Committed):')
+        out.add('dpos, value = _nomatch_res', 1)
+        out.add('_cuts[0] = cuts')
+
+    def __first(self, out, level = 0):
+        out.add('v = src[spos] if spos < len(src) else empty', level)
+        #bytearray item is the byte code
+        out.add('if type(v) is int and type(src) is bytearray:', level)
+        out.add('v = chr(v)', level + 1)
+
+    def __first_ret(self, action, out, level = 0):
+        out.add('v = {}(v)'.format(action), level)
+        out.ret('(1, v) if v != nomatch else _nomatch_res', level)
+
+    def _first_equal(self, grammar, action, out):
+        s = grammar.data
+        if isinstance(s, str) or isinstance(s, unicode):
+            s = self.__str(s)
+            if len(s) != 1:
+                raise Err("{} len != 1", s)
+        elif s != empty:
+            raise Err("{} is not a string", s)
+        self.__first(out)
+        out.add('if v != {}:'.format(self.ref(s)))
+        out.ret('_nomatch_res', 1)
+        self.__first_ret(action, out)
+
+    def _first_any(self, grammar, action, out):
+        pat = grammar.data
+        seq = [x for x in pat] if isinstance(pat, str) else pat
+        self.__first(out)
+        out.add('if v in {}:'.format(self.ref(seq, 'seq')))
+        self.__first_ret(action, out, 1)
+        out.ret('_nomatch_res')
+
+    def _first_pred(self, grammar, action, out):
+        self.__first(out)
+        out.add('if {}(v):'.format(self.ref(grammar.pred, 'pred')))
+        self.__first_ret(action, out, 1)
+        out.ret('_nomatch_res')
+
+    def _first_range(self, grammar, action, out):
+        self.__char_class(Rules.CharClass((grammar.data,)), action, out)
+
+    def __bind_char_class(self, chars):
+        name = self.__next_name('c')
+        self.bind_lines.append('{} = _compile.char_class({})'
+                               .format(name, self.literal(chars.ranges)))
+        return name
+
+    def __char_class(self, chars, action, out):
+        name = self.__bind_char_class(chars)
+        self.__first(out)
+        out.add('if v in {}:'.format(name))
+        self.__first_ret(action, out, 1)
+        out.ret('_nomatch_res')
+
+    def _always(self, grammar, action, out):
+        self.__first(out)
+        self.__first_ret(action, out)
+
+    def __str(self, s):
+        return Rules.text_of(s, self.options)
+
+    def _string(self, grammar, action, out):
+        s = grammar.data
+        if not (isinstance(s, str) or isinstance(s, unicode)):
+            raise Err("{} is not a string", s)
+        s = self.__str(s)
+        slen = len(s)
+        if grammar.is_ignore_case:
+            out.add('v = _compile.as_text(src[spos:spos + {}])'.format(slen))
+            out.add('if isinstance(v, basestring) and v.lower() == {}:'
+                    .format(self.ref(s.lower())))
+            out.ret('({}, {}(v))'.format(slen, action), 1)
+            out.ret('_nomatch_res')
+            return
+        if slen:
+            #compared in place
+            out.add('if type(src) is {}:'.format(type(s).__name__))
+            out.add('is_match = src.startswith({}, spos)'.format(self.ref(s)),
+                    1)
+            out.ret('({}, {}({})) if is_match else _nomatch_res'
+                    .format(slen, action, self.ref(s)), 1)
+        out.add('v = src[spos:spos + {}]'.format(slen))
+        out.ret('({}, {}(v)) if v == {} else _nomatch_res'
+                .format(slen, action, self.ref(s)))
+
+    def _range(self, grammar, action, out):
+        begin, end = grammar.range
+        test = self.function(grammar.rule)
+        if end == 1 and not begin:
+            self.__call(grammar, test, 'spos', out)
+            out.add('if value == nomatch:')
+            out.add('dpos, value = (0, empty)', 1)
+            out.add('value = {}(value)'.format(action))
+            out.ret('(dpos, value) if value != nomatch else _nomatch_res')
+            return
+        is_counted = end != Generate.inf
+        out.add('total = []')
+        out.add('pos = spos')
+        if is_counted:
+            out.add('count = 0')
+        if begin == 1 and not is_counted \
+           and grammar not in self.committing:
+            out.add('try:')
+            out.add('dpos, value = {}(src, pos)'.format(test), 1)
+            out.add('except IndexError:')
+            out.ret('_nomatch_res', 1)
+        else:
+            self.__call(grammar, test, 'pos', out)
+        if begin:
+            out.add('if value == nomatch:')
+            out.ret('_nomatch_res', 1)
+        out.add('while value != nomatch:')
+        if is_counted:
+            out.add('count += 1', 1)
+            out.add('if count > {}:'.format(end), 1)
+            out.ret('_nomatch_res', 2)
+        out.add('if value != empty:', 1)
+        out.add('total.append(value)', 2)
+        out.add('pos += dpos', 1)
+        self.__call(grammar, test, 'pos', out, 1)
+        if is_counted:
+            out.add('if count < {}:'.format(begin))
+            out.ret('_nomatch_res', 1)
+        out.add('res = {}(total)'.format(action))
+        out.ret('(pos - spos, res) if res != nomatch else _nomatch_res')
+
+    def _not(self, grammar, action, out):
+        self.__isolated_call(grammar, self.function(grammar.rule), out)
+        out.add('if value == nomatch:')
+        self.__first(out, 1)
+        out.add('if v is empty:', 1)
+        out.ret('_nomatch_res', 2)
+        out.add('try:', 1)
+        out.add('value = {}(v)'.format(action), 2)
+        out.add('except IndexError:', 1)
+        out.add('value = nomatch', 2)
+        out.ret('(0, value) if value != nomatch else _nomatch_res', 1)
+        out.ret('_nomatch_res')
+
+    def _convert(self, grammar, action, out, dpos = 'dpos'):
+        if dpos == '0':
+            self.__isolated_call(grammar, self.function(grammar.rule), out)
+        else:
+            out.call(self.function(grammar.rule), 'spos', '_nomatch_res')
+        out.add('if value != nomatch:')
+        out.add('value = {}(value)'.format(action), 1)
+        out.ret('({}, value) if value != nomatch else _nomatch_res'
+                .format(dpos), 1)
+        out.ret('_nomatch_res')
+
+    def _lookahead(self, grammar, action, out):
+        self._convert(grammar, action, out, '0')
+
+    def _capture(self, grammar, action, out):
+        #generated functions always build values, captured one is dropped
+        out.call(self.function(grammar.rule), 'spos', '_nomatch_res')
+        out.add('if value == nomatch:')
+        out.ret('_nomatch_res', 1)
+        if grammar.is_span:
+            out.add('value = {}((spos, spos + dpos))'.format(action))
+        else:
+            out.add('value = {}(src[spos:spos + dpos])'.format(action))
+        out.ret('(dpos, value) if value != nomatch else _nomatch_res')
+
+    def _cut(self, grammar, action, out):
+        #memo entries can't be used after the cut
+        out.add('_cuts[0] += 1')
+        out.add('for m in _memos:')
+        out.add('m.clear()', 1)
+        out.add('value = {}(empty)'.format(action))
+        out.ret('(0, value) if value != nomatch else _nomatch_res')
+
+    def _node(self, grammar, action, out):
+        out.call(self.function(grammar.rule), 'spos', '_nomatch_res')
+        out.add('if value == nomatch:')
+        out.ret('_nomatch_res', 1)
+        out.add('value = {}(_compile.node({}, value, spos, spos + dpos))'
+                .format(action, self.literal(grammar.label)))
+        out.ret('(dpos, value) if value != nomatch else _nomatch_res')
+
+    kinds = {
+        Generate.SeqRule: _seq,
+        Generate.ChoiceRule: _choice,
+        Generate.FirstEqualRule: _first_equal,
+        Generate.FirstEqualAnyRule: _first_any,
+        Generate.FirstEqualPredRule: _first_pred,
+        Generate.FirstEqualRangeRule: _first_range,
+        Generate.FirstConsumeRule: _always,
+        Generate.StringRule: _string,
+        Generate.RangeRule: _range,
+        Generate.NotRule: _not,
+        Generate.Converter: _convert,
+        Generate.LookaheadRule: _lookahead,
+        Generate.CaptureRule: _capture,
+        Generate.NodeRule: _node,
+        Generate.CutRule: _cut,
+    }
+
+__global_ops = set(dis.opmap[x] for x in ('LOAD_GLOBAL', 'LOAD_NAME'))
+
+def global_names(code):
+    '''names of globals used by code and nested code objects'''
+    res = set()
+    co, i, ext = code.co_code, 0, 0
+    while i < len(co):
+        op = ord(co[i])
+        if op < dis.HAVE_ARGUMENT:
+            i += 1
+            continue
+        arg = ord(co[i + 1]) + ord(co[i + 2]) * 256 + ext
+        ext = 0
+        if op == dis.EXTENDED_ARG:
+            ext = arg << 16
+        elif op in __global_ops:
+            res.add(code.co_names[arg])
+        i += 3
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            res.update(global_names(c))
+    return res
+
+class Body(object):
+
+    indent = ' ' * 4
+
+    def __init__(self, memo):
+        self.lines = []
+        self.__memo = memo
+
+    def add(self, line, level = 0):
+        self.lines.append(''.join([self.indent * (level + 1), line]))
+
+    def ret(self, expr, level = 0):
+        if self.__memo:
+            self.add('res = {}'.format(expr), level)
+            self.add('{}[spos] = res'.format(self.__memo), level)
+            self.add('return res', level)
+        else:
+            self.add('return {}'.format(expr), level)
+
+    def call(self, fn, pos, on_error, level = 0):
+        self.add('try:', level)
+        self.add('dpos, value = {}(src, {})'.format(fn, pos), level + 1)
+        self.add('except IndexError:', level)
+        self.add('dpos, value = {}'.format(on_error), level + 1)
+
+_header = '''# -*- coding: utf-8 -*-
+# Generated by parsed.Compile from rule {name}, do not edit
+
+from parsed.Common import nomatch, empty
+from parsed import Compile as _compile
+
+_nomatch_res = (0, nomatch)
+#number of cuts passed
+_cuts = [0]
+
+name = {name}
+
+ENV = {env}
+'''
+
+_footer = '''
+
+_memos = ({memos})
+
+def match(src, pos):
+    return {top}(src, pos)
+
+def parse(src):
+    [m.clear() for m in _memos]
+    try:
+        return {top}(src, 0)
+    except _compile.Committed:
+        return _nomatch_res
+
+if not ENV:
+    bind()
+'''
+
+def grammar_of(rule, options):
+    '''(rule, options) of the rule or the parser built by rule(options)'''
+    if isinstance(rule, Generate.Rule):
+        return rule, options
+    grammar = getattr(rule, 'grammar', None)
+    if grammar is None:
+        raise Err("{} is not the parser built by the rule", rule)
+    return grammar, rule.options
+
+def source(rule, options = default_options):
+    '''returns source of the python module matching the same input and
+    producing the same results as parser built by rule(options). Rule
+    can be replaced by the parser built from it'''
+    rule, options = grammar_of(rule, options)
+    rule(options)
+    module = getattr(rule, 'data', None) if isinstance(rule, Generate.TopRule) \
+             else None
+    module = getattr(module, '__module__', None)
+    emitter = Emitter(options, (module,) if module else ())
+    top = emitter.emit_all(rule)
+    names = [x.split(' = ', 1)[0] for x in emitter.bind_lines]
+    memos = ''.join([x + ', ' for x in emitter.memos])
+    res = [_header.format(name = repr(rule.name), env = repr(tuple(emitter.env))),
+           'def bind(**_env):',
+           '    missing = [x for x in ENV if x not in _env]',
+           '    if missing:',
+           '        raise _compile.Err("Missing {}", missing)']
+    if names:
+        res.append('    global {}'.format(', '.join(names)))
+    res += ['    ' + x for x in emitter.bind_lines]
+    res += ['    pass']
+    if emitter.memos:
+        res.append('')
+    res += ['{} = {{}}'.format(x) for x in emitter.memos]
+    res += emitter.rule_lines
+    res.append(_footer.format(memos = memos, top = top))
+    return '\n'.join(res)
+
+def write(rule, path, options = default_options):
+    with open(path, 'w') as f:
+        f.write(source(rule, options))
+
+_dump_header = 'parsed\0'
+#marshalled code is valid only for the same python version
+_dump_magic = _dump_header + imp.get_magic()
+
+def dump(rule, path, options = default_options):
+    '''writes generated module as marshalled code object'''
+    rule, options = grammar_of(rule, options)
+    code = compile(source(rule, options),
+                   '<parsed.Compile {}>'.format(rule.name), 'exec')
+    with open(path, 'wb') as f:
+        f.write(_dump_magic)
+        marshal.dump(code, f)
+
+__loaded = integers()
+
+def load(path, **env):
+    '''imports generated module written by write() or dump(), env
+    should contain values for all names listed in module ENV'''
+    name = '_parsed_compiled_{}'.format(__loaded.next())
+    with open(path, 'rb') as f:
+        magic = f.read(len(_dump_magic))
+        is_dump = magic.startswith(_dump_header)
+        if is_dump:
+            if magic != _dump_magic:
+                raise Err("{} is dumped by other python version", path)
+            code = marshal.load(f)
+    if is_dump:
+        res = imp.new_module(name)
+        res.__file__ = path
+        exec code in vars(res)
+    else:
+        res = imp.load_source(name, path)
+    if res.ENV:
+        res.bind(**env)
+    return res
+
+#runtime support used by generated modules
+
+def attr(mod_name, name):
+    mod = importlib.import_module(mod_name)
+    return mod if name is None else getattr(mod, name)
+
+Committed = Rules.Committed
+as_text = Rules.as_text
+
+def char_class(ranges):
+    return Rules.CharClass(ranges)
+
+def literals(items):
+    return Rules.Literals(items)
+
+def node(label, value, begin, end):
+    return Node.of(label, value, begin, end)
+
+def __cell(v):
+    return (lambda: v).func_closure[0]
+
+def function(code, fn_globals, name, defaults, cells):
+    fn_globals['__builtins__'] = __builtins__
+    return types.FunctionType(marshal.loads(code), fn_globals, name,
+                              defaults or None,
+                              tuple(__cell(v) for v in cells) or None)
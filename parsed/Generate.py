@@ -4,6 +4,12 @@
 # Copyright (c) 2012 Denis Zalevskiy
 # Licensed under MIT License
 
+import mmap
+import pickle
+import re
+import sys
+import weakref
+
 from Rules import *
 from cor import is_iterable, Err, integers, track, log
 from Common import *
@@ -23,13 +29,13 @@ class Forward(object):
     def match(self, src, pos):
         return self.__rule.match(src, pos)
 
+    def scan(self, src, pos):
+        return self.__rule.scan(src, pos)
+
     @property
     def children(self):
         return self.__rule.children
 
-    def _cache_clear(self):
-        return self.__rule._cache_clear()
-
 def mk_first_match_rule(c):
     if c == empty:
         cls = FirstEqualRule
@@ -40,7 +46,6 @@ def mk_first_match_rule(c):
             cls = FirstEqualAnyRule
     elif callable(c):
         cls = FirstEqualPredRule
-        c = match_first_predicate(c)
     else:
         raise Err("Don't know how to make match from {}", c)
     return cls(c)
@@ -91,8 +96,12 @@ def mk_rule_range(rule, from_to, name):
     else:
         err()
 
-    return RangeRule(rule, fn, name)
+    return RangeRule(rule, fn, name, from_to)
+
 
+#rules keeping built parsers, parser of the rule is built once for the
+#same options and shared by all grammars using the rule
+built_rules = weakref.WeakSet()
 
 class Rule(object):
 
@@ -102,7 +111,10 @@ class Rule(object):
         self._action = None
         self.__integers = integers()
         self.__parser = None
-        self.__options = None
+        #frozen options -> parser built with them
+        self.__parsers = {}
+        #key of the parser built with trace buffer or profile object
+        self.__observed = None
 
     def __repr__(self):
         action_name = self.action.__name__ if self.action else ''
@@ -167,32 +179,97 @@ class Rule(object):
 
     @property
     def parser(self):
+        '''parser built for the options rule was called last with'''
         return self.__parser
 
     def has_compatible_parser(self, options):
-        return self.__parser and self.__options == options
-
-    def __parser_declare(self, options):
-        self.__options = options
-        self.__parser = Forward(self.name)
-
-    def __parser_define(self, parser):
-        self.__parser.use(parser)
-        self.__parser = parser
+        return self.__key(options) in self.__parsers
+
+    def __key(self, options):
+        '''memo selection depends on the topmost rule being built, so
+        parsers built with it are kept separately for each topmost rule'''
+        key = options.frozen()
+        if options.is_remember and options.memo_select == 'auto':
+            key = (key, Rule._top or self)
+        return key
+
+    def __parser_declare(self, key, options):
+        if is_observed(options):
+            #observer is usually created for one parse, so only parser
+            #built for the last one is kept
+            self.__parsers.pop(self.__observed, None)
+            self.__observed = key
+        self.__parser = self.__parsers[key] = Forward(self.name)
+        built_rules.add(self)
+
+    def __parser_define(self, key, parser):
+        self.__parsers[key].use(parser)
+        self.__parser = self.__parsers[key] = parser
 
     def parser_cache_reset(self):
         self.__parser = None
+        self.__parsers.clear()
+        self.__observed = None
+
+    #topmost rule being built
+    _top = None
+    #rules to be memoized, chosen by the topmost rule being built
+    _memo_selection = None
+    #rules cut is reachable from, found by the topmost rule being built
+    _committing = None
+
+    def _fn_options(self, options):
+        res = options
+        selection = Rule._memo_selection
+        if selection is not None and options.is_remember \
+           and self not in selection:
+            res = res.copy()
+            res.is_remember = False
+        if self in Rule._committing:
+            #memo hit would skip the cut, so the commit is not made
+            res = res.copy() if res is options else res
+            res.is_commit = True
+            res.is_remember = False
+        return res
 
     def __call__(self, options = default_options):
-        if self.has_compatible_parser(options):
-            return self.parser
-
-        self.__parser_declare(options)
+        key = self.__key(options)
+        parser = self.__parsers.get(key)
+        if parser is not None:
+            self.__parser = parser
+            return parser
+
+        if Rule._committing is None:
+            if options.use_bytes and options.use_unicode:
+                raise Err("Bytes and unicode modes are exclusive")
+            Rule._committing = committing(self)
+            Rule._top = self
+            if options.is_remember and options.memo_select == 'auto':
+                Rule._memo_selection = MemoSelection(self).selected
+            Lexeme._rejected = set()
+            try:
+                parser = self(options)
+                #built parser can be compiled back from its grammar
+                parser.grammar, parser.options = self, options
+                return parser
+            finally:
+                Rule._memo_selection = None
+                Rule._top = None
+                Rule._committing = None
+                Lexeme._rejected = None
+
+        self.__parser_declare(key, options)
+        fn_options = self._fn_options(options)
         parser = self.fn(self.name,
                          self._prepare_context(options),
-                         self.action,
-                         options)
-        self.__parser_define(parser)
+                         defer(self.action, options),
+                         fn_options)
+        lexeme = Lexeme.of(self, options) if Lexeme.is_enabled(options) \
+                 else None
+        if lexeme is not None:
+            lexeme.fallback = parser
+            parser = match_lexeme(self.name, lexeme, self.action, fn_options)
+        self.__parser_define(key, parser)
         return parser
 
 class RuleWithData(Rule):
@@ -249,17 +326,43 @@ class TopRule(RuleWithData):
     def __init__(self, fn):
         super(TopRule, self).__init__(fn, fn.__name__, None)
         self.fn = self._mk_parser
+        self.body = None
+
+    def expand(self):
+        if self.body is None:
+            rule = self.data()
+            rule.name = '.'.join([self.name, rule.name])
+            self.body = rule
+        return self.body
 
     def _mk_parser(self, name, generator, action, options):
-        rule = generator()
-        rule.name = '.'.join([name, rule.name])
-        parser = rule(options)
-        return parser
+        return self.expand()(options)
+
+    def _fn_options(self, options):
+        return options
+
+    def parser_cache_reset(self):
+        super(TopRule, self).parser_cache_reset()
+        self.body = None
 
     @property
     def copy(self):
         return self.__class__(self.data)
 
+    def __reduce__(self):
+        '''rule defined in the module namespace is pickled by the
+        reference, so it can be passed to other processes which build
+        the parser themselves'''
+        module, name = self.data.__module__, self.data.__name__
+        if getattr(sys.modules.get(module), name, None) is not self:
+            raise pickle.PicklingError(
+                "Rule {} is not {}.{}".format(self.name, module, name))
+        return (top_rule, (module, name))
+
+def top_rule(module, name):
+    __import__(module)
+    return getattr(sys.modules[module], name)
+
 class SeqRule(Aggregate):
     def __init__(self, rules, name, action = value):
         super(SeqRule, self).__init__(rules, name, action)
@@ -284,7 +387,66 @@ class ChoiceRule(Aggregate):
         for r in rules:
             r.default_action = value
         super(ChoiceRule, self).__init__(rules, name, action)
-        self.fn = match_any
+        self.__chars = False
+        self.__literals = False
+        #text type -> firsts
+        self.__firsts = {}
+
+    @property
+    def chars(self):
+        '''CharClass if choice is made only of character rules'''
+        if self.__chars is False:
+            ranges = char_ranges(self)
+            self.__chars = None if ranges is None else CharClass(ranges)
+        return self.__chars
+
+    @property
+    def literals(self):
+        '''list of StringRule alternatives if choice is made only of
+        them'''
+        if self.__literals is False:
+            res = [expanded(x) for x in self.rules]
+            is_literals = all(isinstance(x, StringRule) for x in res)
+            self.__literals = res if is_literals else None
+        return self.__literals
+
+    @property
+    def firsts(self):
+        return self.firsts_of(default_options)
+
+    def firsts_of(self, options):
+        '''CharClass of characters each alternative can start with (None
+        if it is tried always) in the source of the type chosen by
+        options, None if no alternative can be skipped'''
+        key = (options.use_unicode, options.use_bytes)
+        if key not in self.__firsts:
+            res = []
+            for alt in self.rules:
+                ranges, is_nullable = first_set(alt, options)
+                is_always = ranges is None or is_nullable
+                res.append(None if is_always else CharClass(ranges))
+            self.__firsts[key] = res if any(x is not None for x in res) \
+                                 else None
+        return self.__firsts[key]
+
+    @property
+    def fn(self):
+        if self.chars is not None:
+            return match_char_class
+        if self.literals is not None:
+            return match_literals
+        return match_dispatch
+
+    def _prepare_context(self, options):
+        chars = self.chars
+        if chars is not None:
+            return chars
+        literals = self.literals
+        if literals is not None:
+            return [(x.data, x.is_ignore_case, defer(x.action, options))
+                    for x in literals]
+        res = super(ChoiceRule, self)._prepare_context(options)
+        return (res, self.firsts_of(options))
 
     def __or__(self, other):
         return ChoiceRule(self.rules + (mk_rule(other),), self.name)
@@ -301,12 +463,19 @@ class NotRule(Modifier):
         return self.rule
 
 class StringRule(RuleWithData):
-    def __init__(self, s, name = None, action = value):
+    def __init__(self, s, name = None, action = value,
+                 is_ignore_case = False):
         if name is None:
-            name = ''.join(['str("', s, '")'])
-        self.fn = match_string
+            name = ''.join(['istr("' if is_ignore_case else 'str("', s, '")'])
+        self.fn = match_string_ignore_case if is_ignore_case else match_string
+        self.is_ignore_case = is_ignore_case
         super(StringRule, self).__init__(s, name, action)
 
+    @property
+    def copy(self):
+        return self.__class__(self.data, self.name, self.default_action,
+                              self.is_ignore_case)
+
 class FirstEqualRule(RuleWithData):
     def __init__(self, c, name = None, action = None):
         if name is None:
@@ -329,14 +498,24 @@ class FirstEqualPredRule(RuleWithData):
     def __init__(self, pred, name = None, action = None):
         if name is None:
             name = pred.__name__
-        self.fn = pred
+        self.pred = pred
+        self.fn = match_first_predicate(pred)
         if action is None:
             action = value
         super(FirstEqualPredRule, self).__init__(nomatch, name, action)
 
     @property
     def copy(self):
-        return self.__class__(self.fn, self.name, self.default_action)
+        return self.__class__(self.pred, self.name, self.default_action)
+
+class FirstEqualRangeRule(RuleWithData):
+    def __init__(self, from_to, name = None, action = None):
+        if name is None:
+            name = '?[{}, {}]'.format(*from_to)
+        self.fn = match_char_range
+        if action is None:
+            action = value
+        super(FirstEqualRangeRule, self).__init__(from_to, name, action)
 
 class FirstConsumeRule(RuleWithData):
     def __init__(self, action = None):
@@ -349,14 +528,32 @@ class FirstConsumeRule(RuleWithData):
     def copy(self):
         return self.__class__(self.default_action)
 
+class CutRule(RuleWithData):
+    '''Matches nothing, after it is passed parser never backtracks
+    to the position before it: failure of any enclosing rule fails the
+    whole parse. Memo entries before the cut are dropped'''
+    def __init__(self, name = 'cut', action = ignore):
+        self.fn = match_cut
+        super(CutRule, self).__init__(None, name, action)
+
+    def _fn_options(self, options):
+        res = options.copy()
+        res.is_remember = False
+        return res
+
+    @property
+    def copy(self):
+        return self.__class__(self.name, self.default_action)
+
 class RangeRule(Modifier):
-    def __init__(self, rule, fn, name):
+    def __init__(self, rule, fn, name, from_to):
         super(RangeRule, self).__init__(rule, name, value)
         self.fn = fn
+        self.range = from_to
 
     @property
     def copy(self):
-        return self.__class__(self.rule, self.fn, self.name)
+        return self.__class__(self.rule, self.fn, self.name, self.range)
 
 class LookaheadRule(Modifier):
     def __init__(self, rule, name, action = ignore):
@@ -366,3 +563,628 @@ class LookaheadRule(Modifier):
 
     def __neg__(self):
         return self
+
+class CaptureRule(Modifier):
+    '''Value is the source text matched by the rule or its (begin,
+    end) span, value of the rule itself is not built'''
+    def __init__(self, rule, name = None, action = value, is_span = False):
+        if name is None:
+            name = ''.join(['span(' if is_span else 'capture(', rule.name,
+                            ')'])
+        super(CaptureRule, self).__init__(rule, name, action)
+        self.is_span = is_span
+        self.fn = match_span if is_span else match_capture
+
+    @property
+    def copy(self):
+        return self.__class__(self.rule, self.name, self.default_action,
+                              self.is_span)
+
+class NodeRule(Modifier):
+    '''Value is the parse tree Node labeled by the rule name or the
+    given label'''
+    def __init__(self, rule, label = None, name = None, action = value):
+        if label is None:
+            label = rule.name
+        if name is None:
+            name = ''.join(['node(', label, ')'])
+        super(NodeRule, self).__init__(rule, name, action)
+        self.label = label
+        self.fn = match_node
+
+    @property
+    def copy(self):
+        return self.__class__(self.rule, self.label, self.name,
+                              self.default_action)
+
+    def _prepare_context(self, options):
+        return (self.rule(options), self.label)
+
+def children(rule):
+    if isinstance(rule, TopRule):
+        return (rule.expand(),)
+    elif isinstance(rule, Aggregate):
+        return rule.rules
+    elif isinstance(rule, Modifier):
+        return (rule.rule,)
+    return ()
+
+def expanded(rule):
+    '''rule TopRule is defined as'''
+    seen = set()
+    while isinstance(rule, TopRule) and rule not in seen:
+        seen.add(rule)
+        rule = rule.expand()
+    return rule
+
+def is_observed(options):
+    '''options refer to trace buffer or profile object'''
+    return not isinstance(options.is_trace, bool) \
+        or not isinstance(options.is_stat, bool)
+
+def reachable(rule):
+    '''set of rules reachable from the rule, including itself'''
+    res = set()
+    stack = [rule]
+    while stack:
+        rule = stack.pop()
+        if rule not in res:
+            res.add(rule)
+            stack.extend(children(rule))
+    return res
+
+def char_ranges(rule, visited = None):
+    '''list of character code ranges matched by the rule if it
+    matches single character from the set returning it as is, None
+    otherwise'''
+    visited = set() if visited is None else visited
+    if rule in visited:
+        return None
+    visited.add(rule)
+    try:
+        return _char_ranges(rule, visited)
+    finally:
+        visited.discard(rule)
+
+def _char_ranges(rule, visited):
+    if isinstance(rule, TopRule):
+        return char_ranges(rule.expand(), visited)
+    if rule.action is not value:
+        return None
+    if isinstance(rule, ChoiceRule):
+        res = []
+        for alt in rule.rules:
+            ranges = char_ranges(alt, visited)
+            if ranges is None:
+                return None
+            res.extend(ranges)
+        return res
+    if isinstance(rule, FirstEqualRangeRule):
+        return [rule.data]
+    if isinstance(rule, (FirstEqualRule, FirstEqualAnyRule)):
+        return chars_ranges(rule.data)
+    return None
+
+def chars_ranges(chars):
+    if not is_iterable(chars) or not chars:
+        return None
+    if not all(isinstance(c, basestring) and len(c) == 1 for c in chars):
+        return None
+    return [(ord(c), ord(c)) for c in chars]
+
+def first_set(rule, options = default_options, visited = None):
+    '''(ranges, is_nullable): list of codes ranges of characters rule
+    match can start with (None if it can start with anything) and can
+    it match without consuming characters in the source of the type
+    chosen by options. Rules which are not analyzed are assumed to
+    start with anything'''
+    visited = set() if visited is None else visited
+    if rule in visited:
+        return (None, True)
+    visited.add(rule)
+    try:
+        return _first_set(rule, options, visited)
+    finally:
+        visited.discard(rule)
+
+def _first_set(rule, options, visited):
+    if isinstance(rule, TopRule):
+        return first_set(rule.expand(), options, visited)
+    if isinstance(rule, (FirstEqualRule, FirstEqualAnyRule)):
+        if rule.data == empty:
+            #end of source only
+            return ([], False)
+        ranges = chars_ranges(rule.data)
+        return (None, True) if ranges is None else (ranges, False)
+    if isinstance(rule, FirstEqualRangeRule):
+        return ([rule.data], False)
+    if isinstance(rule, StringRule):
+        if not rule.data:
+            return ([], True)
+        if rule.is_ignore_case:
+            return (None, True)
+        #unicode is matched as utf-8 in the bytes mode
+        ranges = chars_ranges(text_of(rule.data, options)[0])
+        return (None, True) if ranges is None else (ranges, False)
+    if isinstance(rule, (NotRule, LookaheadRule, CutRule)):
+        return ([], True)
+    if isinstance(rule, (Converter, RangeRule, CaptureRule, NodeRule)):
+        ranges, is_nullable = first_set(rule.rule, options, visited)
+        if isinstance(rule, RangeRule) and rule.range[0] == 0:
+            is_nullable = True
+        return (ranges, is_nullable)
+    if isinstance(rule, ChoiceRule):
+        res, is_nullable = [], False
+        for alt in rule.rules:
+            ranges, alt_nullable = first_set(alt, options, visited)
+            if ranges is None:
+                return (None, True)
+            res.extend(ranges)
+            is_nullable = is_nullable or alt_nullable
+        return (res, is_nullable)
+    if isinstance(rule, SeqRule):
+        res = []
+        for item in rule.rules:
+            ranges, is_nullable = first_set(item, options, visited)
+            if ranges is None:
+                return (None, True)
+            res.extend(ranges)
+            if not is_nullable:
+                return (res, False)
+        return (res, True)
+    return (None, True)
+
+def committing(top):
+    '''set of rules cut is reachable from'''
+    rules = reachable(top)
+    res = set(x for x in rules if isinstance(x, CutRule))
+    if not res:
+        return res
+    rules -= res
+    is_changed = True
+    while is_changed:
+        found = set(x for x in rules
+                    if any(c in res for c in children(x)))
+        rules -= found
+        res |= found
+        is_changed = bool(found)
+    return res
+
+class MemoSelection(object):
+    '''Chooses rules to be memoized: only rules which can be retried at
+    the same position are worth it. These are rules reachable from
+    more than one alternative of some choice and rules reachable from
+    lookahead or negation (they are matched again after lookahead
+    succeeds)'''
+
+    def __init__(self, top):
+        self.rules = reachable(top)
+        self.selected = set()
+        for rule in self.rules:
+            if isinstance(rule, ChoiceRule):
+                seen = set()
+                for alt in rule.rules:
+                    alt_rules = reachable(alt)
+                    self.selected.update(alt_rules & seen)
+                    seen.update(alt_rules)
+            elif isinstance(rule, (NotRule, LookaheadRule)):
+                self.selected.update(reachable(rule.rule))
+
+    @property
+    def report(self):
+        '''list of (rule name, is memoized) sorted by name'''
+        return sorted((x.name, x in self.selected) for x in self.rules)
+
+#actions which never fail, rules inside the lexeme can use only them
+lexeme_actions = (value, ignore, list2str)
+
+class Groups(object):
+    '''group numbers of the regular expression being built'''
+    def __init__(self):
+        self.count = 0
+
+    def next(self):
+        self.count += 1
+        return self.count
+
+    def atomic(self, mk_inner):
+        '''parser does not backtrack into the matched expression'''
+        name = 'g{}'.format(self.next())
+        return ''.join(['(?=(?P<', name, '>', mk_inner(), '))(?P=', name, ')'])
+
+class LexNode(object):
+    '''Part of the lexeme: subclass provides regular expression by
+    pattern(groups, is_recorded) and builds the same value as the rule
+    it replaces using the match object by build(m, src)'''
+
+    def __init__(self, action, children = ()):
+        self.action = action
+        self.children = children
+        self.group = None
+
+    @property
+    def is_ignored(self):
+        return self.action is ignore
+
+    @property
+    def has_loop(self):
+        return any(x.has_loop for x in self.children)
+
+class LexChar(LexNode):
+    def __init__(self, chars, action, is_unicode):
+        super(LexChar, self).__init__(action)
+        top, mk = (0x10ffff, unichr) if is_unicode else (0xff, chr)
+        items = []
+        for begin, end in chars.ranges:
+            if begin > top:
+                break
+            items.append(re.escape(mk(begin)))
+            if end > begin:
+                items += ['-', re.escape(mk(min(end, top)))]
+        self.__pattern = ''.join(['['] + items + [']']) if items else '(?!)'
+
+    def pattern(self, groups, is_recorded):
+        if not (is_recorded and not self.is_ignored):
+            return self.__pattern
+        self.group = groups.next()
+        return ''.join(['(', self.__pattern, ')'])
+
+    def build(self, m, src):
+        return self.action(src[m.start(self.group)]) \
+            if not self.is_ignored else empty
+
+class LexString(LexNode):
+    def __init__(self, s, action):
+        super(LexString, self).__init__(action)
+        self.s = s
+
+    def pattern(self, groups, is_recorded):
+        return re.escape(self.s)
+
+    def build(self, m, src):
+        return self.action(self.s)
+
+class LexSeq(LexNode):
+    def pattern(self, groups, is_recorded):
+        is_recorded = is_recorded and not self.is_ignored
+        return ''.join([x.pattern(groups, is_recorded) for x in self.children])
+
+    def build(self, m, src):
+        if self.is_ignored:
+            return empty
+        total = []
+        for child in self.children:
+            v = child.build(m, src)
+            if v != empty:
+                total.append(v)
+        return self.action(total)
+
+class LexChoice(LexNode):
+    def pattern(self, groups, is_recorded):
+        is_recorded = is_recorded and not self.is_ignored
+        if is_recorded:
+            self.groups = []
+        def alternatives():
+            res = []
+            for child in self.children:
+                if is_recorded:
+                    self.groups.append(groups.next())
+                    res.append(''.join(['(', child.pattern(groups, True), ')']))
+                else:
+                    res.append(child.pattern(groups, False))
+            return ''.join(['(?:', '|'.join(res), ')'])
+        return groups.atomic(alternatives)
+
+    def build(self, m, src):
+        if self.is_ignored:
+            return empty
+        for child, group in zip(self.children, self.groups):
+            if m.start(group) != -1:
+                return self.action(child.build(m, src))
+
+class LexOptional(LexNode):
+    def pattern(self, groups, is_recorded):
+        is_recorded = is_recorded and not self.is_ignored
+        item = self.children[0]
+        def optional():
+            if not is_recorded:
+                return ''.join(['(?:', item.pattern(groups, False), ')?'])
+            self.group = groups.next()
+            return ''.join(['(', item.pattern(groups, True), ')?'])
+        return groups.atomic(optional)
+
+    def build(self, m, src):
+        if self.is_ignored:
+            return empty
+        v = empty if m.start(self.group) == -1 \
+            else self.children[0].build(m, src)
+        return self.action(v)
+
+class LexRepeat(LexNode):
+    '''Repetition, items are matched by own regular expression to
+    build their values'''
+
+    def __init__(self, item, from_to, action):
+        super(LexRepeat, self).__init__(action, (item,))
+        self.range = from_to
+        self.item_pattern = None
+        self.regex = None
+
+    @property
+    def has_loop(self):
+        return True
+
+    def prepare(self):
+        '''builds the item expression, returns its groups count'''
+        item = self.children[0]
+        if self.is_ignored or isinstance(item, LexChar):
+            return 0
+        groups = Groups()
+        self.item_pattern = item.pattern(groups, True)
+        return groups.count
+
+    def compile(self, flags):
+        if self.item_pattern is not None:
+            self.regex = re.compile(self.item_pattern, flags)
+
+    def pattern(self, groups, is_recorded):
+        item = self.children[0]
+        begin, end = self.range
+        suffix = '*' if end == inf else '{{{},{}}}'.format(begin, end)
+        if begin == 1 and end == inf:
+            suffix = '+'
+        if is_recorded and not self.is_ignored:
+            #atomic group spans all items
+            self.group = groups.count + 1
+        res = groups.atomic(lambda: ''.join(['(?:', item.pattern(groups, False),
+                                             ')', suffix]))
+        if end != inf:
+            #closed range does not match if there are more items
+            res = ''.join([res, '(?!', item.pattern(groups, False), ')'])
+        return res
+
+    def build(self, m, src):
+        if self.is_ignored:
+            return empty
+        begin, end = m.span(self.group)
+        item = self.children[0]
+        if isinstance(item, LexChar):
+            if item.action is value:
+                total = list(src[begin:end])
+            elif item.is_ignored:
+                total = []
+            else:
+                total = [item.action(c) for c in src[begin:end]]
+        else:
+            total = []
+            match = self.regex.match
+            while begin < end:
+                im = match(src, begin)
+                v = item.build(im, src)
+                if v != empty:
+                    total.append(v)
+                if im.end() == begin:
+                    break
+                begin = im.end()
+        return self.action(total)
+
+class LexNot(LexNode):
+    def pattern(self, groups, is_recorded):
+        inner = self.children[0].pattern(groups, False)
+        if is_recorded and not self.is_ignored:
+            self.group = groups.next()
+            return ''.join(['(?!', inner, ')(?=(.))'])
+        return ''.join(['(?!', inner, ')(?=.)'])
+
+    def build(self, m, src):
+        if self.is_ignored:
+            return empty
+        return self.action(m.group(self.group))
+
+class LexLookahead(LexNode):
+    def pattern(self, groups, is_recorded):
+        is_recorded = is_recorded and not self.is_ignored
+        return ''.join(['(?=', self.children[0].pattern(groups, is_recorded),
+                        ')'])
+
+    def build(self, m, src):
+        if self.is_ignored:
+            return empty
+        return self.action(self.children[0].build(m, src))
+
+class LexConvert(LexNode):
+    def pattern(self, groups, is_recorded):
+        is_recorded = is_recorded and not self.is_ignored
+        return self.children[0].pattern(groups, is_recorded)
+
+    def build(self, m, src):
+        if self.is_ignored:
+            return empty
+        return self.action(self.children[0].build(m, src))
+
+class LexCapture(LexNode):
+    def __init__(self, action, children, is_span):
+        super(LexCapture, self).__init__(action, children)
+        self.is_span = is_span
+
+    def pattern(self, groups, is_recorded):
+        if not (is_recorded and not self.is_ignored):
+            return self.children[0].pattern(groups, False)
+        self.group = groups.next()
+        return ''.join(['(', self.children[0].pattern(groups, False), ')'])
+
+    def build(self, m, src):
+        if self.is_ignored:
+            return empty
+        begin, end = m.span(self.group)
+        return self.action((begin, end) if self.is_span else src[begin:end])
+
+class Lexeme(object):
+    '''Regular expression replacing the rule subgraph which is built
+    only from character and string terminals, sequences, choices,
+    repetitions and predicates and is not recursive. Parsing
+    expression never backtracks into matched choice or repetition, so
+    they are made atomic using (?=(?P<g>...))(?P=g). Value is built
+    from the match object applying the same actions'''
+
+    #limit of rules in the lexeme, rules are expanded into the tree
+    max_nodes = 200
+    #limit of groups in the regular expression
+    max_groups = 99
+
+    def __init__(self, root, options):
+        self.root = root
+        #regular expression matches mmap too
+        self.text_types = (unicode,) if options.use_unicode \
+                          else (str, mmap.mmap)
+        self.flags = re.DOTALL | (re.UNICODE if options.use_unicode else 0)
+        self.regex = None
+        counts = [node.prepare() for node in self.__nodes(root)
+                  if isinstance(node, LexRepeat)]
+        groups = Groups()
+        self.pattern = root.pattern(groups, True)
+        if max(counts + [groups.count]) > self.max_groups:
+            raise Err("Too many groups in {}", self.pattern)
+
+    def compile(self):
+        '''regular expression is compiled when it is used first time,
+        lexemes of rules inside the bigger lexeme are never used'''
+        if self.regex is None:
+            for node in self.__nodes(self.root):
+                if isinstance(node, LexRepeat):
+                    node.compile(self.flags)
+            self.regex = re.compile(self.pattern, self.flags)
+        return self.regex
+
+    def __nodes(self, node):
+        yield node
+        for child in node.children:
+            for x in self.__nodes(child):
+                yield x
+
+    def build(self, m, src):
+        return self.root.build(m, src)
+
+    #rules found not to be lexical while building the topmost rule
+    _rejected = None
+
+    @staticmethod
+    def is_enabled(options):
+        return options.use_regex and not (options.is_trace or options.is_stat
+                                           or options.is_stream
+                                           or options.is_incremental)
+
+    @staticmethod
+    def of(rule, options):
+        '''lexeme for the rule, None if rule is not lexical or there
+        are no repetitions to be matched faster by the regular
+        expression'''
+        if not isinstance(rule, (Aggregate, Modifier)):
+            #terminals and named rules are not fused themselves
+            return None
+        rejected = Lexeme._rejected
+        if rejected is None:
+            rejected = set()
+        if rule in rejected:
+            return None
+        count = [0]
+        try:
+            root = lex_node(rule, options.use_unicode, set(), rejected,
+                            count, True)
+        except re.error:
+            root = None
+        if root is None or not root.has_loop:
+            return None
+        #values inside the lexeme are built by eager actions
+        root.action = defer(root.action, options)
+        try:
+            return Lexeme(root, options)
+        except Err:
+            rejected.add(rule)
+            return None
+
+def lex_chars(rule, is_unicode):
+    if isinstance(rule, ChoiceRule):
+        return rule.chars
+    if isinstance(rule, FirstEqualRangeRule):
+        return CharClass((rule.data,))
+    if not isinstance(rule, (FirstEqualRule, FirstEqualAnyRule)):
+        return None
+    ranges = chars_ranges(rule.data)
+    if ranges is None:
+        return None
+    for c in rule.data:
+        if ord(c) >= 0x80 and isinstance(c, unicode) != is_unicode:
+            return None
+    return CharClass(ranges)
+
+def lex_node(rule, is_unicode, stack, rejected, count, is_root = False):
+    '''tree of LexNode replacing the rule, None if it is not lexical'''
+    if rule in rejected:
+        return None
+    if rule in stack:
+        #recursive
+        rejected.add(rule)
+        return None
+    count[0] += 1
+    if count[0] > Lexeme.max_nodes:
+        return None
+    if isinstance(rule, TopRule):
+        stack.add(rule)
+        try:
+            return lex_node(rule.expand(), is_unicode, stack, rejected, count)
+        finally:
+            stack.discard(rule)
+
+    action = rule.action
+    if not (is_root or action in lexeme_actions):
+        #can be lexical if it is the root
+        return None
+    res = None
+    chars = lex_chars(rule, is_unicode)
+    if chars is not None:
+        res = LexChar(chars, action, is_unicode)
+    elif isinstance(rule, StringRule) and not rule.is_ignore_case:
+        s = rule.data
+        try:
+            if is_unicode:
+                s = s.decode() if isinstance(s, str) else s
+            else:
+                s = s.encode() if isinstance(s, unicode) else s
+        except UnicodeError:
+            s = None
+        res = None if s is None else LexString(s, action)
+    elif isinstance(rule, (Aggregate, Modifier)):
+        stack.add(rule)
+        try:
+            children = [lex_node(x, is_unicode, stack, rejected, count)
+                        for x in children_of(rule)]
+        finally:
+            stack.discard(rule)
+        if all(x is not None for x in children):
+            res = mk_lex_node(rule, children, action)
+    if res is None and count[0] <= Lexeme.max_nodes:
+        rejected.add(rule)
+    return res
+
+def children_of(rule):
+    return rule.rules if isinstance(rule, Aggregate) else (rule.rule,)
+
+def mk_lex_node(rule, children, action):
+    if isinstance(rule, SeqRule):
+        return LexSeq(action, children)
+    if isinstance(rule, ChoiceRule):
+        return LexChoice(action, children)
+    if isinstance(rule, RangeRule):
+        if rule.range == (0, 1):
+            return LexOptional(action, children)
+        return LexRepeat(children[0], rule.range, action)
+    if isinstance(rule, NotRule):
+        return LexNot(action, children)
+    if isinstance(rule, LookaheadRule):
+        return LexLookahead(action, children)
+    if isinstance(rule, Converter):
+        return LexConvert(action, children)
+    if isinstance(rule, CaptureRule):
+        return LexCapture(action, children, rule.is_span)
+    return None
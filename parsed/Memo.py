@@ -0,0 +1,332 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+'''Memoization used by CachingRule. Memo is kept in the per-parse
+Table, each memoized rule gets own column in the table identified by
+the small integer rule id. Column type depends on the policy chosen
+with mk_options(memo = <name or class>, memo_limit = <limit>):
+
+* unbounded: remember everything until the next parse (default),
+  dense column indexed by position
+
+* lru: remember up to memo_limit most recently used entries
+
+* window: remember only entries at most memo_limit positions behind
+  the furthest position reached
+
+* bytes: remember entries while estimated memory used by them is
+  below memo_limit bytes, oldest entries are dropped first
+
+Column is created as cls(limit, size), where size is the number of
+positions in the source (None if unknown). It maps position to the
+rule match result and provides get(pos), put(pos, res) and cut(pos)
+methods, the last one drops entries before pos when parser passes
+the cut.
+
+Parser built with is_incremental option uses Examined columns in the
+Revisable table kept between parses of the edited text.
+'''
+
+import collections
+import heapq
+import sys
+from array import array
+
+from cor import Err
+from Common import nomatch
+
+_nomatch_res = (0, nomatch)
+
+class Dense(object):
+    '''Column storing consumed length in the array indexed by
+    position and results in the list. Arrays grow on demand up to the
+    source size. Length is unknown (no entry) or failed (nomatch) for
+    negative values'''
+
+    unknown = -1
+    failed = -2
+    __chunk = array('i', [unknown])
+
+    def __init__(self, limit = None, size = None):
+        self.lengths = array('i')
+        self.values = []
+        self.__size = size
+        self.__floor = 0
+
+    def grow(self, pos):
+        size = max(pos + 1, 2 * len(self.lengths), 64)
+        if self.__size is not None:
+            size = max(pos + 1, min(size, self.__size))
+        count = size - len(self.lengths)
+        self.lengths.extend(self.__chunk * count)
+        self.values.extend([None] * count)
+
+    def get(self, pos):
+        return self.values[pos] if pos < len(self.values) else None
+
+    def put(self, pos, res):
+        if pos >= len(self.values):
+            self.grow(pos)
+        self.values[pos] = res
+        self.lengths[pos] = res[0] if res[1] != nomatch else self.failed
+
+    def edit(self, offset, removed, inserted):
+        '''entries after the edited range are moved, entries inside it
+        are dropped'''
+        if offset < len(self.values):
+            end = offset + removed
+            self.values[offset:end] = [None] * inserted
+            self.lengths[offset:end] = self.__chunk * inserted
+        self.__floor = min(self.__floor, offset)
+
+    def cut(self, pos):
+        '''drops results before pos, slots are kept'''
+        end = min(pos, len(self.values))
+        count = end - self.__floor
+        if count > 0:
+            self.values[self.__floor:end] = [None] * count
+            self.lengths[self.__floor:end] = self.__chunk * count
+            self.__floor = end
+
+    def __len__(self):
+        return len(self.lengths) - self.lengths.count(self.unknown)
+
+    @property
+    def size(self):
+        return self.lengths.itemsize * len(self.lengths) \
+            + sys.getsizeof(self.values)
+
+class Examined(Dense):
+    '''Dense column also storing how many positions were examined by
+    the rule match (including the lookup past the end of the source),
+    match result depends only on the examined text'''
+
+    __zeros = array('i', [0])
+
+    def __init__(self, limit = None, size = None):
+        super(Examined, self).__init__(limit, size)
+        self.examined = array('i')
+
+    def grow(self, pos):
+        super(Examined, self).grow(pos)
+        count = len(self.lengths) - len(self.examined)
+        self.examined.extend(self.__zeros * count)
+
+    def put(self, pos, res, examined = 0):
+        super(Examined, self).put(pos, res)
+        self.examined[pos] = examined
+
+    def invalidate(self, begin, end, offset):
+        '''drops entries in [begin, end) examined text after offset,
+        returns the furthest position examined by the rest'''
+        values, examined = self.values, self.examined
+        furthest = 0
+        for pos in xrange(begin, min(end, len(values))):
+            if values[pos] is not None:
+                reach = pos + examined[pos]
+                if reach > offset:
+                    values[pos] = None
+                    self.lengths[pos] = self.unknown
+                elif reach > furthest:
+                    furthest = reach
+        return furthest
+
+    def edit(self, offset, removed, inserted):
+        if offset < len(self.examined):
+            self.examined[offset:offset + removed] = self.__zeros * inserted
+        super(Examined, self).edit(offset, removed, inserted)
+
+class Lru(collections.OrderedDict):
+
+    def __init__(self, limit, size = None):
+        super(Lru, self).__init__()
+        self.limit = limit
+
+    def get(self, pos):
+        res = super(Lru, self).pop(pos, None)
+        if res is not None:
+            self[pos] = res
+        return res
+
+    def put(self, pos, res):
+        self[pos] = res
+        if len(self) > self.limit:
+            self.popitem(last = False)
+
+    def cut(self, pos):
+        for x in [x for x in self if x < pos]:
+            del self[x]
+
+    @property
+    def size(self):
+        return sys.getsizeof(self)
+
+class Window(dict):
+
+    def __init__(self, limit, size = None):
+        super(Window, self).__init__()
+        self.limit = limit
+        self.furthest = 0
+        self.__positions = []
+
+    def put(self, pos, res):
+        self[pos] = res
+        heapq.heappush(self.__positions, pos)
+        if pos > self.furthest:
+            self.furthest = pos
+            oldest = pos - self.limit
+            positions = self.__positions
+            while positions[0] < oldest:
+                self.pop(heapq.heappop(positions), None)
+
+    def cut(self, pos):
+        positions = self.__positions
+        while positions and positions[0] < pos:
+            self.pop(heapq.heappop(positions), None)
+
+    @property
+    def size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.__positions)
+
+class Budget(collections.OrderedDict):
+
+    #approximate cost of the dictionary slot holding an entry
+    slot_size = 3 * 8
+
+    def __init__(self, limit, size = None):
+        super(Budget, self).__init__()
+        self.limit = limit
+        self.size = 0
+
+    def entry_size(self, pos, res):
+        return self.slot_size + sys.getsizeof(pos) + sys.getsizeof(res)
+
+    def put(self, pos, res):
+        self[pos] = res
+        self.size += self.entry_size(pos, res)
+        while self.size > self.limit and self:
+            pos, res = self.popitem(last = False)
+            self.size -= self.entry_size(pos, res)
+
+    def cut(self, pos):
+        for x in [x for x in self if x < pos]:
+            self.size -= self.entry_size(x, self.pop(x))
+
+class Table(object):
+    '''Per-parse memo: column for each memoized rule'''
+
+    def __init__(self, size = None):
+        self.positions = size
+        self.columns = {}
+        #number of cuts passed
+        self.cuts = 0
+
+    def cut(self, pos):
+        self.cuts += 1
+        for column in self.columns.values():
+            column.cut(pos)
+
+    def column(self, rule_id, factory):
+        res = self.columns.get(rule_id)
+        if res is None:
+            res = factory(self.positions)
+            self.columns[rule_id] = res
+        return res
+
+    @property
+    def entries(self):
+        return sum(len(x) for x in self.columns.values())
+
+    @property
+    def size(self):
+        '''memory used by memo structures in bytes, results are not
+        accounted'''
+        return sum(x.size for x in self.columns.values())
+
+class Revisable(Table):
+    '''Memo table kept between parses of the edited text. To find
+    entries affected by the edit quickly the furthest examined
+    position is tracked for each block of positions'''
+
+    shift = 6
+
+    def __init__(self):
+        super(Revisable, self).__init__()
+        self.reach = array('i')
+
+    def reached(self, pos, reach):
+        block = pos >> self.shift
+        if block >= len(self.reach):
+            count = max(block + 1, 2 * len(self.reach)) - len(self.reach)
+            self.reach.extend(array('i', [0]) * count)
+        if reach > self.reach[block]:
+            self.reach[block] = reach
+
+    def edit(self, offset, removed, inserted):
+        '''text in [offset, offset + removed) is replaced with inserted
+        characters: entries examined edited text are dropped, entries
+        after it are moved'''
+        shift = self.shift
+        reach = self.reach
+        first = offset >> shift
+        #blocks after the tracked ones have no entries, so all tracked
+        #blocks are candidates if offset is beyond them
+        candidates = min(first + 1, len(reach))
+        if candidates and max(reach[:candidates]) > offset:
+            for block in xrange(candidates):
+                if reach[block] > offset:
+                    begin = block << shift
+                    end = min(begin + (1 << shift), offset)
+                    furthest = max([0] + [x.invalidate(begin, end, offset)
+                                          for x in self.columns.values()])
+                    #block with the offset keeps entries moved later
+                    if block < first:
+                        reach[block] = furthest
+        for column in self.columns.values():
+            column.edit(offset, removed, inserted)
+        self.__move(offset, inserted - removed)
+
+    def __move(self, offset, delta):
+        '''blocks after offset are moved by delta, new values are
+        upper estimations'''
+        shift, old = self.shift, self.reach
+        first = offset >> shift
+        if first >= len(old):
+            return
+        #partially filled last block is kept
+        count = max(((len(old) << shift) + delta + (1 << shift) - 1) >> shift,
+                    first + 1)
+        res = old[:first]
+        for block in xrange(first, count):
+            begin = max((((block << shift) - delta) >> shift), first)
+            end = min((((block + 1) << shift) - 1 - delta) >> shift,
+                      len(old) - 1)
+            reach = max(old[begin:end + 1]) + delta if begin <= end else 0
+            res.append(max(reach, offset) if block == first else reach)
+        self.reach = res
+
+policies = {
+    'unbounded': Dense,
+    'lru': Lru,
+    'window': Window,
+    'bytes': Budget,
+}
+
+def policy(options):
+    '''returns factory creating memo for rule built with options'''
+    cls = options.memo
+    if options.is_incremental:
+        if cls not in (Dense, 'unbounded'):
+            raise Err("Incremental parser requires unbounded memo")
+        return lambda size: Examined(None, size)
+    if not isinstance(cls, type):
+        if cls not in policies:
+            raise Err("Unknown memo policy {}", cls)
+        cls = policies[cls]
+    limit = options.memo_limit
+    if limit is None and cls is not Dense:
+        raise Err("Memo policy {} requires memo_limit", options.memo)
+    return lambda size: cls(limit, size)
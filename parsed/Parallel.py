@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+'''Parsing of the large file made of independent records by the pool
+of processes. File is split into ranges after the record boundary
+(delimiter string or rule), each range is parsed by the worker process
+using own parser built by grammar(options) and values are returned in
+the order of ranges:
+
+        @rule
+        def cards(): return vcard[0:] + eof
+        values = parse_file('all.vcf', cards, 'END:VCARD\\r\\n')
+
+Grammar and options are passed to workers, so they should be
+picklable: grammar is a rule or a function defined in the module
+namespace (pickled by the reference), options should not contain
+closures. Values returned by the grammar are pickled as well.
+'''
+
+import multiprocessing
+
+import Generate
+import Rules
+from Common import *
+from cor import Err
+
+def mk_finder(boundary):
+    '''fn(src, begin, end) returning position after the first boundary
+    found in src[begin:end] or None'''
+    if isinstance(boundary, basestring):
+        def find(src, begin, end):
+            pos = src.find(boundary, begin, end)
+            return None if pos < 0 else pos + len(boundary)
+        return find
+
+    parser = Generate.mk_rule(boundary)(mk_options())
+
+    def scan(src, begin, end):
+        #boundary starting in the window can end behind it
+        data = src[begin:end + (end - begin)]
+        parser.cache_clear()
+        for pos in xrange(end - begin):
+            dpos, value = parser.scan(data, pos)
+            if value != nomatch and dpos:
+                return begin + pos + dpos
+        return None
+    return scan
+
+def split(src, boundary, count, window = 64 * 1024):
+    '''up to count (begin, end) ranges of src of nearly equal size,
+    each one except the last ends after the boundary'''
+    find = mk_finder(boundary)
+    size = len(src)
+    res = []
+    begin = 0
+    for i in xrange(1, count):
+        pos = max(begin, size * i // count)
+        end = None
+        while end is None and pos < size:
+            end = find(src, pos, min(pos + window, size))
+            pos += window
+        if end is None or end >= size:
+            break
+        if end > begin:
+            res.append((begin, end))
+            begin = end
+    res.append((begin, size))
+    return res
+
+_worker = None
+
+def _init_worker(path, grammar, options):
+    global _worker
+    src = Rules.mapped(path)
+    _worker = (src, grammar(options), options.use_unicode)
+
+def _parse_range(begin_end):
+    src, parser, use_unicode = _worker
+    begin, end = begin_end
+    data = src[begin:end]
+    if use_unicode:
+        data = data.decode('utf-8')
+    pos, value = parser.parse(data)
+    if value == nomatch or pos < len(data):
+        return (False, pos)
+    return (True, value)
+
+def _close_worker():
+    global _worker
+    src = _worker[0]
+    _worker = None
+    if src:
+        src.close()
+
+def parse_file(path, grammar, boundary, options = None, processes = None,
+               chunk_size = 1024 * 1024):
+    '''list of values of the file ranges parsed by grammar(options).
+    Ranges are split after the boundary and are about chunk_size bytes
+    long. Decoded utf-8 ranges are parsed if use_unicode option is set,
+    byte strings otherwise. Err is raised if the range is not parsed
+    completely'''
+    options = mk_options() if options is None else options
+    processes = processes or multiprocessing.cpu_count()
+    src = Rules.mapped(path)
+    try:
+        count = max(processes, (len(src) + chunk_size - 1) // chunk_size)
+        ranges = split(src, boundary, count)
+    finally:
+        if src:
+            src.close()
+
+    if processes == 1:
+        _init_worker(path, grammar, options)
+        try:
+            results = map(_parse_range, ranges)
+        finally:
+            _close_worker()
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker,
+                                    (path, grammar, options))
+        try:
+            results = pool.map(_parse_range, ranges, 1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    res = []
+    for (begin, end), (is_parsed, value) in zip(ranges, results):
+        if not is_parsed:
+            raise Err("Range [{}, {}) of {} is not parsed, stopped at {}"
+                      " position of the range", begin, end, path, value)
+        res.append(value)
+    return res
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+'''Per rule profile of the parser built with is_stat option set to
+the Profile: calls count, memo hits, matches, consumed length,
+inclusive and exclusive wall time. It can be exported as pstats data
+and as collapsed stacks text for flame graphs:
+
+        prof = profile()
+        pos, value = grammar(mk_options(is_stat = prof)).parse(src)
+        print prof.report(20)
+        pstats.Stats(prof).sort_stats('time').print_stats(20)
+        with open('parse.folded', 'w') as f:
+            f.write(prof.collapsed())
+'''
+
+import marshal
+import timeit
+
+import cor
+from Common import *
+
+class RuleStat(object):
+
+    __slots__ = ('name', 'calls', 'primitive', 'hits', 'matches',
+                 'consumed', 'inclusive', 'exclusive', 'active')
+
+    def __init__(self, name):
+        self.name = name
+        #calls not nested into the call of the same rule
+        self.primitive = 0
+        self.calls = self.hits = self.matches = self.consumed = 0
+        self.inclusive = self.exclusive = 0.0
+        self.active = 0
+
+    @property
+    def hit_ratio(self):
+        return float(self.hits) / self.calls if self.calls else 0.0
+
+    @property
+    def average_length(self):
+        return float(self.consumed) / self.matches if self.matches else 0.0
+
+    def __repr__(self):
+        return 'RuleStat({!r}, calls={}, hits={}, matches={}, ' \
+            'consumed={}, inclusive={:.6f}, exclusive={:.6f})'.format(
+                self.name, self.calls, self.hits, self.matches,
+                self.consumed, self.inclusive, self.exclusive)
+
+class Frame(object):
+    '''node of the calls tree, time is exclusive'''
+
+    __slots__ = ('name', 'children', 'time')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.time = 0.0
+
+class Profile(object):
+
+    def __init__(self, timer = timeit.default_timer):
+        self.timer = timer
+        #rule name -> RuleStat
+        self.rules = {}
+        #(caller name, rule name) -> [calls, exclusive, inclusive]
+        self.edges = {}
+        self.root = Frame(None)
+        #[frame, time of children, count of children calls]
+        self.__stack = [[self.root, 0.0, 0]]
+
+    def profiled(self, name, fn, hits):
+        '''fn(src, pos) gathering the rule profile, hits() is the
+        total count of memo hits'''
+        stat = self.rules.get(name)
+        if stat is None:
+            stat = self.rules[name] = RuleStat(name)
+        timer, stack, edges = self.timer, self.__stack, self.edges
+
+        def match(src, pos):
+            parent = stack[-1]
+            caller = parent[0]
+            frame = caller.children.get(name)
+            if frame is None:
+                frame = caller.children[name] = Frame(name)
+            record = [frame, 0.0, 0]
+            stack.append(record)
+            is_primitive = not stat.active
+            stat.active += 1
+            hits_before = hits()
+            begin = timer()
+            try:
+                res = fn(src, pos)
+            finally:
+                elapsed = timer() - begin
+                stack.pop()
+                stat.active -= 1
+            exclusive = elapsed - record[1]
+            parent[1] += elapsed
+            parent[2] += 1
+            frame.time += exclusive
+            stat.calls += 1
+            stat.exclusive += exclusive
+            if is_primitive:
+                stat.primitive += 1
+                stat.inclusive += elapsed
+            #memo hit returns without matching children
+            if not record[2] and hits() - hits_before == 1:
+                stat.hits += 1
+            if res[1] != nomatch:
+                stat.matches += 1
+                stat.consumed += res[0]
+            edge = edges.get((caller.name, name))
+            if edge is None:
+                edge = edges[(caller.name, name)] = [0, 0.0, 0.0]
+            edge[0] += 1
+            edge[1] += exclusive
+            edge[2] += elapsed
+            return res
+        return match
+
+    def clear(self):
+        for stat in self.rules.values():
+            stat.__init__(stat.name)
+        self.edges.clear()
+        self.root.children.clear()
+
+    def report(self, limit = None):
+        '''text table of rules sorted by exclusive time'''
+        stats = sorted(self.rules.values(), key = lambda x: -x.exclusive)
+        lines = ['{:>8} {:>6} {:>8} {:>10} {:>10}  {}'.format(
+            'calls', 'hits%', 'avg len', 'incl', 'excl', 'rule')]
+        for x in stats[:limit]:
+            lines.append('{:8d} {:6.1f} {:8.1f} {:10.6f} {:10.6f}  {}'.format(
+                x.calls, x.hit_ratio * 100, x.average_length, x.inclusive,
+                x.exclusive, cor.escape_str(x.name)))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def __key(name):
+        return ('parsed', 0, name)
+
+    def create_stats(self):
+        '''sets stats in the format used by pstats, so pstats.Stats
+        accepts the profile'''
+        callers = {}
+        for (caller, name), (calls, exclusive, inclusive) \
+            in self.edges.items():
+            if caller is not None:
+                callers.setdefault(name, {})[self.__key(caller)] \
+                    = (calls, calls, exclusive, inclusive)
+        self.stats = {}
+        for name, x in self.rules.items():
+            self.stats[self.__key(name)] = (x.primitive, x.calls, x.exclusive,
+                                            x.inclusive,
+                                            callers.get(name, {}))
+
+    def dump_stats(self, path):
+        '''writes pstats file'''
+        self.create_stats()
+        with open(path, 'wb') as f:
+            marshal.dump(self.stats, f)
+
+    def collapsed(self):
+        '''collapsed stacks text: line per calls path "rule;rule;rule
+        N", N is exclusive time in microseconds'''
+        lines = []
+        stack = [(x, ()) for x in self.root.children.values()]
+        while stack:
+            frame, path = stack.pop()
+            path += (cor.escape_str(frame.name).replace(';', ','),)
+            us = int(round(frame.time * 1000000))
+            if us > 0:
+                lines.append('{} {}'.format(';'.join(path), us))
+            stack.extend((x, path) for x in frame.children.values())
+        return '\n'.join(sorted(lines))
@@ -4,7 +4,15 @@
 # Copyright (c) 2012 Denis Zalevskiy
 # Licensed under MIT License
 
+import bisect
+import collections
+import mmap
+import os
+import sys
+
 import cor
+import Memo
+import Profile
 from cor import Err
 from Common import *
 
@@ -15,11 +23,30 @@ class Rule(object):
             self.__fn = fn
             self.match = self.__match_stat
             self.__stat = cor.Options(hits = 0, misses = 0)
+            if isinstance(options.is_stat, Profile.Profile):
+                self.match = options.is_stat.profiled(name, self.match,
+                                                      memo_hits)
         else:
             self.match = fn
+        self.scan = self.__scan_match
+        self.__is_deferred = options.is_deferred
         self.__name__ = name
         self.__children = tuple()
 
+    def __scan_match(self, src, pos):
+        #rule without own scanner builds the value and drops it
+        try:
+            dpos, value = self.match(src, pos)
+        except IndexError as e:
+            return _nomatch_res
+        return (dpos, empty) if value != nomatch else _nomatch_res
+
+    def scanner(self, fn):
+        '''decorates fn(src, pos) matching the rule without building the
+        value, it returns (length, empty) or (0, nomatch)'''
+        self.scan = fn
+        return fn
+
     def __match_stat(self, src, pos):
         pos, value = self.__fn(src, pos)
         if value == nomatch:
@@ -51,71 +78,277 @@ class Rule(object):
         return self.__name__
 
     def parse(self, src):
-        self.cache_clear()
-        return self.match(src, 0)
+        self.cache_clear(Memo.Table(positions_count(src)))
+        try:
+            return self.evaluate(self.match(src, 0))
+        except Committed:
+            return _nomatch_res
 
-    def _cache_clear(self):
-        pass
+    def evaluate(self, res):
+        '''parse result with deferred actions applied'''
+        if not self.__is_deferred or res[1] == nomatch:
+            return res
+        return (res[0], evaluated(res[1]))
 
-    def cache_clear(self):
-        return cor.apply_on_graph(self, lambda x: x._cache_clear,
-                                  lambda x: x.children)
+    def recognize(self, src):
+        '''length of the matched src prefix or None if it is not
+        matched. Values are not built and actions are not called'''
+        self.cache_clear(Memo.Table(positions_count(src)))
+        try:
+            dpos, value = self.scan(src, 0)
+        except Committed:
+            return None
+        return dpos if value != nomatch else None
+
+    def cache_clear(self, memo = None):
+        '''starts new memo table, memoizing rules switch to it on the
+        next match'''
+        CachingRule._memo = Memo.Table() if memo is None else memo
+
+def memo_hits():
+    return CachingRule._cache_hits
 
 class CachingRule(Rule):
 
     _cache_hits = 0
+    _ids = cor.integers()
+    #memo table of the current parse
+    _memo = Memo.Table()
 
     def __init__(self, fn, name, options):
-        self.__fn = fn
-        super(CachingRule, self).__init__(self.__match, name, options)
-        self.__cache = dict()
-
-    def __match(self, src, pos):
-        if pos in self.__cache:
-            CachingRule._cache_hits += 1
-            return self.__cache[pos]
-        res = self.__fn(src, pos)
-        self.__cache[pos] = res
-        return res
+        self.__id = CachingRule._ids.next()
+        self.__mk_cache = Memo.policy(options)
+        #[memo table, column] of the match memo, the column is attached
+        #to the memo table on the first match
+        self.__match_memo = [None, None]
+        if options.is_incremental:
+            self.__memoized = self.__memoized_incremental
+        elif isinstance(self.__mk_cache(None), Memo.Dense):
+            self.__memoized = self.__memoized_dense
+        else:
+            self.__memoized = self.__memoized_sparse
+        super(CachingRule, self).__init__(
+            self.__memoized(fn, self.__id, self.__match_memo), name, options)
 
-    def _cache_clear(self):
-        self.__cache = dict()
+    def scanner(self, fn):
+        #scan results have no values, so they are kept in own column
+        #not to be returned by match
+        return super(CachingRule, self).scanner(
+            self.__memoized(fn, -1 - self.__id, [None, None]))
 
-class Tracer(object):
+    def __attach(self, memo, column_id):
+        memo[0] = CachingRule._memo
+        memo[1] = memo[0].column(column_id, self.__mk_cache)
+        return memo[1]
 
-    debug_indent_level = 0
-    debug_indent_sym = ' ' * 2
+    def __memoized_sparse(self, fn, column_id, memo):
+        attach = self.__attach
+        def match(src, pos):
+            cache = memo[1] if memo[0] is CachingRule._memo \
+                    else attach(memo, column_id)
+            res = cache.get(pos)
+            if res is not None:
+                CachingRule._cache_hits += 1
+                return res
+            res = fn(src, pos)
+            cache.put(pos, res)
+            return res
+        return match
 
-    def __indent_plus(self):
-        Tracer.debug_indent_level += 1
+    def __memoized_dense(self, fn, column_id, memo):
+        failed = Memo.Dense.failed
+        attach = self.__attach
+        def match(src, pos):
+            cache = memo[1] if memo[0] is CachingRule._memo \
+                    else attach(memo, column_id)
+            values = cache.values
+            try:
+                res = values[pos]
+            except IndexError:
+                cache.grow(pos)
+                res = None
+            if res is not None:
+                CachingRule._cache_hits += 1
+                return res
+            res = fn(src, pos)
+            values[pos] = res
+            cache.lengths[pos] = res[0] if res[1] != nomatch else failed
+            return res
+        return match
 
-    def __indent_minus(self, *args):
-        Tracer.debug_indent_level -= 1
+    def __memoized_incremental(self, fn, column_id, memo):
+        attach = self.__attach
+        def match(src, pos):
+            if memo[0] is not CachingRule._memo:
+                attach(memo, column_id)
+                if not isinstance(memo[0], Memo.Revisable):
+                    raise Err("Incremental parser should be used by "
+                              "Incremental")
+            table, cache = memo
+            res = cache.get(pos)
+            if res is not None:
+                CachingRule._cache_hits += 1
+                src.examine(pos + cache.examined[pos])
+                return res
+            reach = src.reach
+            src.reach = pos
+            res = fn(src, pos)
+            cache.put(pos, res, src.reach - pos)
+            table.reached(pos, src.reach)
+            src.examine(reach)
+            return res
+        return match
 
-    def debug_print(self, msg, *args, **kwargs):
-        indent = Tracer.debug_indent_sym * Tracer.debug_indent_level
-        cor.log("{}{}", indent, msg.format(*args, **kwargs))
+    @property
+    def id(self):
+        return self.__id
 
-    def __init__(self, rule):
-        self.__indent = cor.Scope(self.__indent_plus,
-                                  self.__indent_minus)
+    @property
+    def memo(self):
+        memo = self.__match_memo
+        if memo[0] is not CachingRule._memo:
+            self.__attach(memo, self.__id)
+        return memo[1]
+
+class Trace(object):
+    '''Bounded buffer of the tracing events, the oldest events are
+    dropped. Event is the list [depth, rule name, position, result],
+    result is None until the rule match is finished. Only rules named
+    as one of the names (or rules of their bodies) are recorded if
+    names are given, only positions in the [begin, end) window if it is
+    given. Text is rendered on demand'''
+
+    def __init__(self, limit = 10000, names = None, window = None):
+        self.events = collections.deque(maxlen = limit)
+        self.names = None if names is None else frozenset(names)
+        self.window = window
+        self.depth = 0
+
+    def is_named(self, name):
+        if self.names is None:
+            return True
+        return name in self.names or name.split('.', 1)[0] in self.names
+
+    def enter(self, name, src, pos):
+        '''event of the rule match starting at pos, None if it is not
+        traced'''
+        self.depth += 1
+        window = self.window
+        if window is not None and not window[0] <= pos < window[1]:
+            return None
+        event = [self.depth - 1, name, pos, None]
+        self.events.append(event)
+        return event
+
+    def leave(self, event, res):
+        self.depth -= 1
+        if event is not None:
+            event[3] = res
+
+    def clear(self):
+        self.events.clear()
+        self.depth = 0
+
+    def render(self, src = None, indent = '  '):
+        '''text of the recorded events, beginning of the matched
+        source is shown if src is given'''
+        lines = []
+        #outer events could be dropped or filtered out
+        base = min(x[0] for x in self.events) if self.events else 0
+        for depth, name, pos, res in self.events:
+            text = '' if src is None \
+                   else ' ' + cor.wrap('"', snippet(src, pos))
+            if res is None:
+                res = 'unfinished'
+            elif res[1] == nomatch:
+                res = 'nomatch'
+            else:
+                res = cor.printable_args(res)
+            lines.append('{}{}@{}{} => {}'.format(
+                indent * (depth - base), cor.escape_str(name), pos, text, res))
+        return '\n'.join(lines)
+
+def snippet(src, pos, size = 20):
+    '''escaped beginning of the source at pos'''
+    res = as_text(src[pos:pos + size + 1])
+    if not isinstance(res, basestring):
+        res = str(res)
+    if len(res) > size:
+        res = ''.join([res[:size], '...'])
+    return cor.escape_str(res)
+
+class LogTrace(Trace):
+    '''Trace written into stderr while parsing'''
+
+    indent = ' ' * 2
+
+    def __init__(self, names = None, window = None):
+        super(LogTrace, self).__init__(0, names, window)
+
+    def enter(self, name, src, pos):
+        event = super(LogTrace, self).enter(name, src, pos)
+        if event is not None:
+            cor.log("{}{}({}) {{", self.indent * event[0], name,
+                    cor.wrap('"', snippet(src, pos)))
+        return event
+
+    def leave(self, event, res):
+        super(LogTrace, self).leave(event, res)
+        if event is not None:
+            cor.log("{}}} => {}", self.indent * event[0],
+                    cor.printable_args(res))
+
+class Tracer(object):
+    '''Records rule matches into the trace given by is_trace option,
+    into the stderr if it is True'''
+
+    _log = LogTrace()
+
+    def __init__(self, rule, trace = None):
         self.__rule = rule
         self.__name__ = rule.__name__
+        self.__trace = Tracer._log if trace is None else trace
+        self.__is_named = self.__trace.is_named(self.__name__.rstrip('?'))
 
     def parse(self, src):
-        return self.match(src, 0)
+        self.cache_clear(Memo.Table(positions_count(src)))
+        try:
+            return self.evaluate(self.match(src, 0))
+        except Committed:
+            return _nomatch_res
 
-    def match(self, src, pos):
-        dend = len(src) - pos
-        pr = str(src[pos:]) if dend <= 20 \
-             else ''.join([str(src[pos:pos + 20]), '...'])
-        pr = cor.escape_str(pr)
-        self.debug_print("{}({}) {{", self.__name__, cor.wrap('"', pr))
-        with self.__indent:
-            res = self.__rule.match(src, pos)
-        self.debug_print("}} => {}", cor.printable_args(res))
+    def evaluate(self, res):
+        return self.__rule.evaluate(res)
+
+    def recognize(self, src):
+        self.cache_clear(Memo.Table(positions_count(src)))
+        try:
+            dpos, value = self.scan(src, 0)
+        except Committed:
+            return None
+        return dpos if value != nomatch else None
+
+    def __traced(self, match, src, pos):
+        if not self.__is_named:
+            return match(src, pos)
+        trace = self.__trace
+        event = trace.enter(self.__name__, src, pos)
+        res = None
+        try:
+            res = match(src, pos)
+        finally:
+            trace.leave(event, res)
         return res
 
+    def match(self, src, pos):
+        return self.__traced(self.__rule.match, src, pos)
+
+    def scan(self, src, pos):
+        return self.__traced(self.__rule.scan, src, pos)
+
+    def scanner(self, fn):
+        return self.__rule.scanner(fn)
+
     @property
     def children(self):
         return self.__rule.children
@@ -128,8 +361,285 @@ class Tracer(object):
     def name(self):
         return self.__name__
 
-    def cache_clear(self):
-        return self.__rule.cache_clear()
+    def cache_clear(self, memo = None):
+        return self.__rule.cache_clear(memo)
+
+class InfiniteInput(object):
+    '''Streaming source reading chunks from the file-like object (using
+    read(chunk_size)) or from the iterable producing strings on demand.
+    Positions are counted from begin, input is limited by end if it is
+    not None.
+
+    Parser built with is_stream option keeps its backtrack points
+    (positions where choice, lookahead, negation or repetition item
+    started) in the source, so data behind the oldest backtrack point
+    is released when the next chunk is read. Backtrack points of
+    choices and repetitions behind the last passed cut are not kept,
+    lookahead and negation positions are always kept. Memo does not
+    refer to the source data, it should be bounded separately
+    (e.g. using 'window' memo policy or cut) to keep memory bounded'''
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, src, begin = 0, end = None, chunk_size = None):
+        size = chunk_size or self.chunk_size
+        if hasattr(src, 'read'):
+            self.__next = lambda: src.read(size)
+        else:
+            chunks = iter((src,) if isinstance(src, basestring) else src)
+            self.__next = lambda: next(chunks, '')
+        self.__buf = ''
+        self.__base = 0
+        self.__end = None
+        self.__holds = []
+        self.__pins = []
+        self.__floor = 0
+        self.__is_tracked = False
+        self.__limit = None if end is None else end - begin
+        while begin > 0:
+            chunk = self.__read()
+            if not chunk:
+                break
+            self.__buf = chunk[begin:]
+            begin -= len(chunk)
+
+    def hold(self, pos):
+        self.__is_tracked = True
+        self.__holds.append(pos)
+
+    def unhold(self):
+        self.__holds.pop()
+
+    def pin(self, pos):
+        self.__is_tracked = True
+        self.__pins.append(pos)
+
+    def unpin(self):
+        self.__pins.pop()
+
+    def cut(self, pos):
+        if not self.__pins:
+            self.__is_tracked = True
+            self.__floor = max(self.__floor, pos)
+
+    @property
+    def begin(self):
+        '''position of the oldest data still kept'''
+        return self.__base
+
+    @property
+    def buffered(self):
+        return len(self.__buf)
+
+    def __read(self):
+        chunk = self.__next()
+        if not chunk:
+            self.__end = self.__base + len(self.__buf)
+        return chunk
+
+    def __fill(self, start, stop):
+        if start < self.__base:
+            raise Err("Position {} is already released", start)
+        if self.__limit is not None:
+            stop = min(stop, self.__limit)
+        while self.__end is None and self.__base + len(self.__buf) < stop:
+            chunk = self.__read()
+            if not chunk:
+                break
+            if self.__is_tracked:
+                #backtrack points behind the cut are not used anymore
+                keep = max(self.__floor, min(self.__holds + [start]))
+                keep = min(self.__pins + [keep, start,
+                                          self.__base + len(self.__buf)])
+                self.__buf = self.__buf[keep - self.__base:]
+                self.__base = keep
+            self.__buf += chunk
+        if self.__limit is not None and self.__base + len(self.__buf) >= self.__limit:
+            self.__buf = self.__buf[:self.__limit - self.__base]
+            self.__end = self.__limit
+
+    def __len__(self):
+        '''length is unknown (sys.maxsize) until the end is read'''
+        return sys.maxsize if self.__end is None else self.__end
+
+    def __getitem__(self, key):
+        '''position after the end is empty'''
+        if isinstance(key, slice):
+            start = 0 if key.start is None else key.start
+            if key.stop is None or key.step is not None:
+                raise Err("Can't slice infinite input with {}", key)
+            self.__fill(start, key.stop)
+            return self.__buf[start - self.__base:key.stop - self.__base]
+        if key < 0:
+            raise IndexError(key)
+        self.__fill(key, key + 1)
+        if key >= self.__base + len(self.__buf):
+            return empty
+        return self.__buf[key - self.__base]
+
+class Tracked(object):
+    '''Text source remembering the furthest position looked at'''
+
+    def __init__(self, text):
+        self.text = text
+        self.reach = 0
+
+    def examine(self, reach):
+        if reach > self.reach:
+            self.reach = reach
+
+    def edit(self, offset, removed, inserted):
+        text = self.text
+        self.text = text[:offset] + inserted + text[offset + removed:]
+
+    def __len__(self):
+        #looking for the end is tracked by indexing past it
+        return sys.maxsize
+
+    def __getitem__(self, key):
+        '''position after the end is empty'''
+        if isinstance(key, slice):
+            self.examine(len(self.text) + 1 if key.stop is None else key.stop)
+            return self.text[key]
+        self.examine(key + 1)
+        return self.text[key] if key < len(self.text) else empty
+
+class Incremental(object):
+    '''Parses the text and reparses it after edits, reusing memo
+    entries which did not examine the edited text. Parser should be
+    built with is_incremental option'''
+
+    def __init__(self, parser, text):
+        self.parser = parser
+        self.__src = Tracked(text)
+        self.__memo = Memo.Revisable()
+
+    @property
+    def text(self):
+        return self.__src.text
+
+    def parse(self):
+        self.parser.cache_clear(self.__memo)
+        self.__src.reach = 0
+        try:
+            return self.parser.evaluate(self.parser.match(self.__src, 0))
+        except Committed:
+            return _nomatch_res
+
+    def edit(self, offset, removed, inserted):
+        '''replaces removed characters starting from offset with the
+        inserted text and reparses it'''
+        self.__src.edit(offset, removed, inserted)
+        self.__memo.edit(offset, removed, len(inserted))
+        return self.parse()
+
+def mapped(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            #empty file can't be mapped
+            return ''
+        return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+def positions_count(src):
+    '''number of positions parser can be at in src, None if unknown'''
+    return None if isinstance(src, InfiniteInput) else len(src) + 1
+
+class Holder(object):
+    '''keeps position in the streaming source while rule is matched
+    there, it is used for rules parser can backtrack from. Pinned
+    position is kept even if cut is passed. Other sources are kept
+    whole, so they are matched as is'''
+
+    def __init__(self, rule, is_pinned = False):
+        self.__rule = rule
+        self.__is_pinned = is_pinned
+
+    def match(self, src, pos):
+        return self.__held(self.__rule.match, src, pos)
+
+    def scan(self, src, pos):
+        return self.__held(self.__rule.scan, src, pos)
+
+    def __held(self, match, src, pos):
+        if not isinstance(src, InfiniteInput):
+            return match(src, pos)
+        if self.__is_pinned:
+            src.pin(pos)
+        else:
+            src.hold(pos)
+        try:
+            return match(src, pos)
+        finally:
+            if self.__is_pinned:
+                src.unpin()
+            else:
+                src.unhold()
+
+def held(test, options, is_pinned = False):
+    return Holder(test, is_pinned) if options.is_stream else test
+
+class Committed(Exception):
+    '''parser failed after passing the cut, so it can't backtrack'''
+    pass
+
+class Commit(object):
+    '''raises Committed if the cut was passed while rule was matched
+    and then rule failed'''
+
+    def __init__(self, rule):
+        self.__rule = rule
+
+    def match(self, src, pos):
+        return self.__committed(self.__rule.match, src, pos)
+
+    def scan(self, src, pos):
+        return self.__committed(self.__rule.scan, src, pos)
+
+    def __committed(self, match, src, pos):
+        cuts = CachingRule._memo.cuts
+        try:
+            res = match(src, pos)
+        except IndexError:
+            if CachingRule._memo.cuts != cuts:
+                raise Committed()
+            raise
+        if res[1] == nomatch and CachingRule._memo.cuts != cuts:
+            raise Committed()
+        return res
+
+class Isolated(object):
+    '''cut passed while rule is matched affects only this rule'''
+
+    def __init__(self, rule):
+        self.__rule = rule
+
+    def match(self, src, pos):
+        return self.__isolated(self.__rule.match, src, pos)
+
+    def scan(self, src, pos):
+        return self.__isolated(self.__rule.scan, src, pos)
+
+    def __isolated(self, match, src, pos):
+        memo = CachingRule._memo
+        cuts = memo.cuts
+        try:
+            return match(src, pos)
+        except Committed:
+            return _nomatch_res
+        finally:
+            memo.cuts = cuts
+
+def backtrack_point(test, options):
+    '''wraps rule parser can backtrack from'''
+    if options.is_commit:
+        test = Commit(test)
+    return held(test, options)
+
+def predicate_point(test, options):
+    '''wraps rule of lookahead or negation'''
+    if options.is_commit:
+        test = Isolated(test)
+    return held(test, options, True)
 
 
 def rule(name, options):
@@ -140,7 +650,8 @@ def rule(name, options):
         cls = CachingRule if options.is_remember else Rule
         fn = cls(match_fn, mk_name(name), options)
         if options.is_trace:
-            return Tracer(fn)
+            trace = options.is_trace
+            return Tracer(fn, trace if isinstance(trace, Trace) else None)
         else:
             return fn
 
@@ -149,32 +660,225 @@ def rule(name, options):
 #standard return if rule is not matched
 _nomatch_res = (0, nomatch)
 
+#actions applied immediately by the parser with deferred actions
+eager_actions = (value, ignore)
+
+class Deferred(object):
+    '''Application of the action recorded by the parser built with
+    is_deferred option, it is evaluated only if it is the part of the
+    parse result'''
+
+    __slots__ = ('action', 'arg', 'value')
+
+    def __init__(self, action, arg):
+        self.action = action
+        self.arg = arg
+        self.value = nomatch
+
+    def __repr__(self):
+        return 'Deferred({}, {!r})'.format(self.action.__name__, self.arg)
+
+def defer(action, options):
+    '''action used by the parser built with options'''
+    if not options.is_deferred or action is None \
+       or action in eager_actions:
+        return action
+    def deferred(x):
+        return Deferred(action, x)
+    deferred.__name__ = action.__name__
+    return deferred
+
+def evaluated(v):
+    '''value with deferred actions applied, each one only once. Empty
+    items are dropped from lists as parser does with ignored values'''
+    if isinstance(v, Deferred):
+        if v.value is nomatch:
+            try:
+                res = v.action(evaluated(v.arg))
+            except IndexError as e:
+                #parser treats it as nomatch returned by the action
+                res = nomatch
+            if res == nomatch:
+                raise Err("Deferred action {} rejected {!r}",
+                          v.action.__name__, v.arg)
+            v.value = res
+        return v.value
+    if isinstance(v, list):
+        return [x for x in (evaluated(item) for item in v) if x != empty]
+    if isinstance(v, tuple):
+        return tuple(evaluated(item) for item in v)
+    if isinstance(v, Node):
+        return Node(v.name, evaluated(v.children), v.begin, v.end)
+    return v
+
 def match_first_predicate(pred):
     def wrapper(name, dummy, action, options):
         @rule(name, options)
         def fn(src, pos):
-            try:
-                v = src[pos]
-            except IndexError as e:
-                v = empty
+            v = src[pos] if pos < len(src) else empty
+            #bytearray item is the byte code
+            if type(v) is int and type(src) is bytearray:
+                v = chr(v)
             if pred(v):
                 v = action(v)
                 return (1, v) if v != nomatch else _nomatch_res
             else:
                 return _nomatch_res
+
+        @fn.scanner
+        def scan(src, pos):
+            v = src[pos] if pos < len(src) else empty
+            if type(v) is int and type(src) is bytearray:
+                v = chr(v)
+            return (1, empty) if pred(v) else _nomatch_res
         return fn
     return wrapper
 
+class CharClass(object):
+    '''Set of characters given by code ranges. Small sets are kept as
+    sets of codes, large ones are checked using bisect on sorted
+    ranges'''
+
+    max_codes = 256
+
+    def __init__(self, ranges):
+        merged = []
+        for begin, end in sorted(ranges):
+            if merged and begin <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([begin, end])
+        self.ranges = tuple((begin, end) for begin, end in merged)
+        self.begins = [x[0] for x in self.ranges]
+        self.ends = [x[1] for x in self.ranges]
+        count = sum(end - begin + 1 for begin, end in self.ranges)
+        self.codes = frozenset(i for begin, end in self.ranges
+                               for i in xrange(begin, end + 1)) \
+                     if count <= self.max_codes else None
+
+    def __contains__(self, c):
+        try:
+            i = ord(c)
+        except TypeError:
+            return False
+        return self.has_code(i)
+
+    def has_code(self, i):
+        if self.codes is not None:
+            return i in self.codes
+        k = bisect.bisect_right(self.begins, i) - 1
+        return k >= 0 and i <= self.ends[k]
+
+    def __repr__(self):
+        return 'CharClass({!r})'.format(self.ranges)
+
+def match_char_class(name, chars, action, options):
+    custom_options = options.copy()
+    custom_options.is_remember = False
+    codes, begins, ends = chars.codes, chars.begins, chars.ends
+    bisect_right = bisect.bisect_right
+
+    @rule(name, custom_options)
+    def match_codes(src, pos):
+        if pos >= len(src):
+            return _nomatch_res
+        v = src[pos]
+        try:
+            i = ord(v)
+        except TypeError as e:
+            if type(src) is not bytearray:
+                return _nomatch_res
+            i, v = v, chr(v)
+        if i not in codes:
+            return _nomatch_res
+        v = action(v)
+        return (1, v) if v != nomatch else _nomatch_res
+
+    @match_codes.scanner
+    def scan_codes(src, pos):
+        if pos >= len(src):
+            return _nomatch_res
+        v = src[pos]
+        try:
+            i = ord(v)
+        except TypeError as e:
+            if type(src) is not bytearray:
+                return _nomatch_res
+            i = v
+        return (1, empty) if i in codes else _nomatch_res
+
+    @rule(name, custom_options)
+    def match_ranges(src, pos):
+        if pos >= len(src):
+            return _nomatch_res
+        v = src[pos]
+        try:
+            i = ord(v)
+        except TypeError as e:
+            if type(src) is not bytearray:
+                return _nomatch_res
+            i, v = v, chr(v)
+        k = bisect_right(begins, i) - 1
+        if k < 0 or i > ends[k]:
+            return _nomatch_res
+        v = action(v)
+        return (1, v) if v != nomatch else _nomatch_res
+
+    @match_ranges.scanner
+    def scan_ranges(src, pos):
+        if pos >= len(src):
+            return _nomatch_res
+        v = src[pos]
+        try:
+            i = ord(v)
+        except TypeError as e:
+            if type(src) is not bytearray:
+                return _nomatch_res
+            i = v
+        k = bisect_right(begins, i) - 1
+        return (1, empty) if k >= 0 and i <= ends[k] else _nomatch_res
+
+    return match_codes if codes is not None else match_ranges
+
+def match_char_range(name, from_to, action, options):
+    return match_char_class(name, CharClass((from_to,)), action, options)
+
+def match_lexeme(name, lexeme, action, options):
+    '''lexeme regular expression is used for text of the same type,
+    other sources are matched by the lexeme fallback rule'''
+    text_types = lexeme.text_types
+    build = lexeme.build
+    fallback = lexeme.fallback
+
+    def compiled_match(src, pos):
+        regex_match[0] = lexeme.compile().match
+        return regex_match[0](src, pos)
+    regex_match = [compiled_match]
+
+    @rule(name, options)
+    def fn(src, pos):
+        if not isinstance(src, text_types):
+            return fallback.match(src, pos)
+        m = regex_match[0](src, pos)
+        if m is None:
+            return _nomatch_res
+        v = build(m, src)
+        return (m.end() - pos, v) if v != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        if not isinstance(src, text_types):
+            return fallback.scan(src, pos)
+        m = regex_match[0](src, pos)
+        return (m.end() - pos, empty) if m is not None else _nomatch_res
+    fn.children = list((fallback,))
+    return fn
+
 def match_first(name, s, action, options):
     if isinstance(s, str) or isinstance(s, unicode):
+        s = text_of(s, options)
         if len(s) != 1:
             raise Err("{} len != 1", s)
-        if options.use_unicode:
-            if isinstance(s, str):
-                s = s.decode()
-        else:
-            if isinstance(s, unicode):
-                s = s.encode()
     elif s != empty:
         raise Err("{} is not a string", s)
 
@@ -183,36 +887,202 @@ def match_first(name, s, action, options):
 
     @rule(name, custom_options)
     def fn(src, pos):
-        try:
-            v = src[pos]
-        except IndexError as e:
-            v = empty
+        v = src[pos] if pos < len(src) else empty
+        if type(v) is int and type(src) is bytearray:
+            v = chr(v)
         if v != s:
             return _nomatch_res
 
         v = action(v)
         return (1, v) if v != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        v = src[pos] if pos < len(src) else empty
+        if type(v) is int and type(src) is bytearray:
+            v = chr(v)
+        return (1, empty) if v == s else _nomatch_res
     return fn
 
-def match_string(name, s, action, options):
+def text_of(s, options):
+    '''string converted to the source text type chosen by options,
+    unicode is matched as utf-8 in the bytes mode'''
     if not (isinstance(s, str) or isinstance(s, unicode)):
         raise Err("{} is not a string", s)
     if options.use_unicode:
-        if isinstance(s, str):
-            s = s.decode()
-    else:
-        if isinstance(s, unicode):
-            s = s.encode()
+        return s.decode() if isinstance(s, str) else s
+    if options.use_bytes:
+        return s.encode('utf-8') if isinstance(s, unicode) else s
+    return s.encode() if isinstance(s, unicode) else s
+
+def text_types(options):
+    '''types of sources walked in place: the text type and buffers
+    indexed by characters in the bytes mode'''
+    if options.use_unicode:
+        return (unicode,)
+    return (str, mmap.mmap, memoryview) if options.use_bytes else (str,)
+
+#sources matched by the string literal using find()
+buffer_types = (bytearray, mmap.mmap)
+
+def as_text(v):
+    '''slice of bytearray or memoryview source copied into str, other
+    values are returned as is'''
+    if isinstance(v, memoryview):
+        return v.tobytes()
+    return str(v) if isinstance(v, bytearray) else v
+
+def match_string(name, s, action, options):
+    '''literal is compared in place for sources of the same text type
+    and buffers, value is the literal itself. Other sources are
+    sliced'''
+    s = text_of(s, options)
+    slen = len(s)
+    text_type = type(s)
+
+    @rule(name, options)
+    def match_in_place(src, pos):
+        src_type = type(src)
+        if src_type is text_type:
+            is_match = src.startswith(s, pos)
+        elif src_type in buffer_types:
+            is_match = src.find(s, pos, pos + slen) == pos
+        elif src_type is memoryview:
+            #slice is a view
+            is_match = src[pos:pos + slen] == s
+        else:
+            v = src[pos:pos + slen]
+            return (slen, action(v)) if v == s else _nomatch_res
+        return (slen, action(s)) if is_match else _nomatch_res
+
+    @match_in_place.scanner
+    def scan_in_place(src, pos):
+        src_type = type(src)
+        if src_type is text_type:
+            is_match = src.startswith(s, pos)
+        elif src_type in buffer_types:
+            is_match = src.find(s, pos, pos + slen) == pos
+        else:
+            is_match = src[pos:pos + slen] == s
+        return (slen, empty) if is_match else _nomatch_res
+
+    @rule(name, options)
+    def match_empty(src, pos):
+        v = src[pos:pos]
+        return (0, action(v)) if v == s else _nomatch_res
+
+    @match_empty.scanner
+    def scan_empty(src, pos):
+        return (0, empty) if src[pos:pos] == s else _nomatch_res
+
+    return match_in_place if slen else match_empty
+
+def match_string_ignore_case(name, s, action, options):
+    '''value is the matched source text'''
+    s = text_of(s, options).lower()
     slen = len(s)
     @rule(name, options)
     def fn(src, pos):
-        if len(src) - pos < slen:
-            return _nomatch_res
-        try:
-            v = str(src[pos:pos + slen])
-        except IndexError as e:
-            return _nomatch_res
-        return (slen, action(v)) if v == s else _nomatch_res
+        v = src[pos:pos + slen]
+        if not isinstance(v, basestring):
+            v = as_text(v)
+        if isinstance(v, basestring) and v.lower() == s:
+            return (slen, action(v))
+        return _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        v = src[pos:pos + slen]
+        if not isinstance(v, basestring):
+            v = as_text(v)
+        if isinstance(v, basestring) and v.lower() == s:
+            return (slen, empty)
+        return _nomatch_res
+    return fn
+
+class Literals(object):
+    '''Trie of the choice alternatives strings given as (string,
+    is_ignore_case) pairs. Source text is walked once to find all
+    alternatives it starts with'''
+
+    def __init__(self, items):
+        self.items = tuple(items)
+        self.length = max(len(s) for s, is_ignore_case in self.items)
+        self.exact, self.folded = {}, {}
+        for i, (s, is_ignore_case) in enumerate(self.items):
+            node = self.folded if is_ignore_case else self.exact
+            for c in (s.lower() if is_ignore_case else s):
+                node = node.setdefault(c, {})
+            node.setdefault(None, []).append(i)
+
+    def find(self, src, pos = 0):
+        '''list of (alternative index, matched length) for literals
+        found in src at pos ordered by index'''
+        res = []
+        if self.exact:
+            self.__walk(self.exact, src, pos, False, res)
+        if self.folded:
+            self.__walk(self.folded, src, pos, True, res)
+        if len(res) > 1:
+            res.sort()
+        return res
+
+    @staticmethod
+    def __walk(node, src, pos, is_folded, res):
+        end, size = pos, len(src)
+        while True:
+            ends = node.get(None)
+            if ends:
+                res.extend((i, end - pos) for i in ends)
+            if end >= size:
+                return
+            c = src[end]
+            node = node.get(c.lower() if is_folded else c)
+            if node is None:
+                return
+            end += 1
+
+def match_literals(name, items, conv, options):
+    '''choice of string literals given as (string, is_ignore_case,
+    action) for each alternative. Sources of the literals text type
+    are walked in place'''
+    literals = Literals((text_of(s, options), is_ignore_case)
+                        for s, is_ignore_case, action in items)
+    find, length = literals.find, literals.length
+    actions = [action for s, is_ignore_case, action in items]
+    #value of the exact literal match is the literal itself
+    texts = [None if is_ignore_case else s
+             for s, is_ignore_case in literals.items]
+    in_place = text_types(options)
+
+    @rule(name, options)
+    def fn(src, pos):
+        if type(src) in in_place:
+            found = find(src, pos)
+        else:
+            src = as_text(src[pos:pos + length])
+            if not isinstance(src, basestring):
+                return _nomatch_res
+            found, pos = find(src), 0
+        for i, n in found:
+            v = texts[i]
+            value = actions[i](v if v is not None else src[pos:pos + n])
+            if value != nomatch:
+                value = conv(value)
+                if value != nomatch:
+                    return (n, value)
+        return _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        if type(src) in in_place:
+            found = find(src, pos)
+        else:
+            src = as_text(src[pos:pos + length])
+            if not isinstance(src, basestring):
+                return _nomatch_res
+            found = find(src)
+        return (found[0][1], empty) if found else _nomatch_res
     return fn
 
 def match_iterable(name, pat, conv, options):
@@ -222,20 +1092,79 @@ def match_iterable(name, pat, conv, options):
     seq = [x for x in pat] if isinstance(pat, str) else pat
     @rule(name, options)
     def fn(src, pos):
-        try:
-            v = src[pos]
-        except IndexError as e:
-            v = empty
+        v = src[pos] if pos < len(src) else empty
+        if type(v) is int and type(src) is bytearray:
+            v = chr(v)
         if v in seq:
             v = conv(v)
             return (1, v) if v != nomatch else _nomatch_res
         else:
             return _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        v = src[pos] if pos < len(src) else empty
+        if type(v) is int and type(src) is bytearray:
+            v = chr(v)
+        return (1, empty) if v in seq else _nomatch_res
     return fn
 
 def match_any(name, tests, conv, options):
+    alternatives = [backtrack_point(test, options) for test in tests]
     @rule(name, options)
     def fn(src, pos):
+        for test in alternatives:
+            try:
+                dpos, value = test.match(src, pos)
+            except IndexError as e:
+                return _nomatch_res
+
+            if value != nomatch:
+                value = conv(value)
+                if (value != nomatch):
+                    return (dpos, value)
+        return _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        for test in alternatives:
+            res = test.scan(src, pos)
+            if res[1] != nomatch:
+                return res
+        return _nomatch_res
+    fn.children = tests
+    return fn
+
+def match_dispatch(name, tests_firsts, conv, options):
+    '''ordered choice trying only alternatives which can start with the
+    next character: firsts are CharClass of such characters for each
+    alternative or None if it should be tried always. All alternatives
+    are tried at the end of source and for non-character items'''
+    tests, firsts = tests_firsts
+    if firsts is None:
+        return match_any(name, tests, conv, options)
+    alternatives = [backtrack_point(test, options) for test in tests]
+    table = {}
+
+    def candidates(code):
+        res = tuple(test for test, chars in zip(alternatives, firsts)
+                    if chars is None or chars.has_code(code))
+        table[code] = res
+        return res
+
+    @rule(name, options)
+    def fn(src, pos):
+        tests = alternatives
+        if pos < len(src):
+            c = src[pos]
+            try:
+                code = ord(c)
+            except TypeError as e:
+                code = c if type(src) is bytearray else None
+            if code is not None:
+                tests = table.get(code)
+                if tests is None:
+                    tests = candidates(code)
         for test in tests:
             try:
                 dpos, value = test.match(src, pos)
@@ -247,18 +1176,58 @@ def match_any(name, tests, conv, options):
                 if (value != nomatch):
                     return (dpos, value)
         return _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        tests = alternatives
+        if pos < len(src):
+            c = src[pos]
+            try:
+                code = ord(c)
+            except TypeError as e:
+                code = c if type(src) is bytearray else None
+            if code is not None:
+                tests = table.get(code)
+                if tests is None:
+                    tests = candidates(code)
+        for test in tests:
+            res = test.scan(src, pos)
+            if res[1] != nomatch:
+                return res
+        return _nomatch_res
     fn.children = tests
     return fn
 
 def match_always(name, dummy, action, options):
     @rule(name, options)
     def fn(src, pos):
-        try:
-            v = src[pos]
-        except IndexError as e:
-            v = empty
+        v = src[pos] if pos < len(src) else empty
+        if type(v) is int and type(src) is bytearray:
+            v = chr(v)
         v = action(v)
         return (1, v) if v != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        return (1, empty)
+    return fn
+
+def match_cut(name, dummy, action, options):
+    is_stream = options.is_stream
+    @rule(name, options)
+    def fn(src, pos):
+        CachingRule._memo.cut(pos)
+        if is_stream and isinstance(src, InfiniteInput):
+            src.cut(pos)
+        v = action(empty)
+        return (0, v) if v != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, pos):
+        CachingRule._memo.cut(pos)
+        if is_stream and isinstance(src, InfiniteInput):
+            src.cut(pos)
+        return (0, empty)
     return fn
 
 def match_seq(name, tests, conv, options):
@@ -278,16 +1247,27 @@ def match_seq(name, tests, conv, options):
             pos += dpos
         res = conv(total)
         return (pos - spos, res) if res != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        pos = spos
+        for test in tests:
+            dpos, value = test.scan(src, pos)
+            if value == nomatch:
+                return _nomatch_res
+            pos += dpos
+        return (pos - spos, empty)
     fn.children = tests
     return fn
 
 def one_more(name, test, conv, options):
+    item = backtrack_point(test, options)
     @rule(name, options)
     def fn(src, spos):
         total = []
         pos = spos
         try:
-            dpos, value = test.match(src, pos)
+            dpos, value = item.match(src, pos)
         except IndexError as e:
             return _nomatch_res
         if value == nomatch:
@@ -297,23 +1277,35 @@ def one_more(name, test, conv, options):
                 total.append(value)
             pos += dpos
             try:
-                dpos, value = test.match(src, pos)
+                dpos, value = item.match(src, pos)
             except IndexError as e:
                 dpos, value = 0, nomatch
         res = conv(total)
         return (pos - spos, res) if res != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        pos = spos
+        dpos, value = item.scan(src, pos)
+        if value == nomatch:
+            return _nomatch_res
+        while value != nomatch:
+            pos += dpos
+            dpos, value = item.scan(src, pos)
+        return (pos - spos, empty)
     fn.children = list((test,))
     return fn
 
 def mk_closed_range(begin, end):
     def closed_range(name, test, conv, options):
+        item = backtrack_point(test, options)
         @rule(name, options)
         def fn(src, spos):
             count = 0
             total = []
             pos = spos
             try:
-                dpos, value = test.match(src, pos)
+                dpos, value = item.match(src, pos)
             except IndexError as e:
                 dpos, value = _nomatch_res
 
@@ -327,7 +1319,7 @@ def mk_closed_range(begin, end):
                     total.append(value)
                 pos += dpos
                 try:
-                    dpos, value = test.match(src, pos)
+                    dpos, value = item.match(src, pos)
                 except IndexError as e:
                     dpos, value = _nomatch_res
             if count >= begin:
@@ -336,17 +1328,33 @@ def mk_closed_range(begin, end):
             else:
                 return _nomatch_res
 
+        @fn.scanner
+        def scan(src, spos):
+            count = 0
+            pos = spos
+            dpos, value = item.scan(src, pos)
+            if value == nomatch:
+                return _nomatch_res
+            while value != nomatch:
+                count += 1
+                if count > end:
+                    return _nomatch_res
+                pos += dpos
+                dpos, value = item.scan(src, pos)
+            return (pos - spos, empty) if count >= begin else _nomatch_res
+
         fn.children = list((test,))
         return fn
     return closed_range
 
 def zero_more(name, test, conv, options):
+    item = backtrack_point(test, options)
     @rule(name, options)
     def fn(src, spos):
         total = []
         pos = spos
         try:
-            dpos, value = test.match(src, pos)
+            dpos, value = item.match(src, pos)
         except IndexError as e:
             dpos, value = _nomatch_res
 
@@ -355,19 +1363,29 @@ def zero_more(name, test, conv, options):
                 total.append(value)
             pos += dpos
             try:
-                dpos, value = test.match(src, pos)
+                dpos, value = item.match(src, pos)
             except IndexError as e:
                 dpos, value = _nomatch_res
         res = conv(total)
         return (pos - spos, res) if res != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        pos = spos
+        dpos, value = item.scan(src, pos)
+        while value != nomatch:
+            pos += dpos
+            dpos, value = item.scan(src, pos)
+        return (pos - spos, empty)
     fn.children = list((test,))
     return fn
 
 def range_0_1(name, test, conv, options):
+    item = backtrack_point(test, options)
     @rule(name, options)
     def fn(src, spos):
         try:
-            dpos, value = test.match(src, spos)
+            dpos, value = item.match(src, spos)
         except IndexError as e:
             dpos, value = _nomatch_res
         if value == nomatch:
@@ -375,24 +1393,41 @@ def range_0_1(name, test, conv, options):
 
         value = conv(value)
         return (dpos, value) if value != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        dpos, value = item.scan(src, spos)
+        return (dpos, empty) if value != nomatch else (0, empty)
     fn.children = list((test,))
     return fn
 
 def not_equal(name, test, conv, options):
+    item = predicate_point(test, options)
     @rule(name, options)
     def fn(src, spos):
         try:
-            dpos, value = test.match(src, spos)
+            dpos, value = item.match(src, spos)
         except IndexError as e:
             dpos, value = _nomatch_res
         if value == nomatch:
+            v = src[spos] if spos < len(src) else empty
+            if v is empty:
+                return _nomatch_res
+            if type(v) is int and type(src) is bytearray:
+                v = chr(v)
             try:
-                value = conv(src[spos])
+                value = conv(v)
             except IndexError as e:
                 value = nomatch
             return (0, value) if value != nomatch else _nomatch_res
         else:
             return _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        if item.scan(src, spos)[1] != nomatch or spos >= len(src):
+            return _nomatch_res
+        return (0, empty)
     fn.children = list((test,))
     return fn
 
@@ -408,20 +1443,114 @@ def convert(name, test, action, options):
             return (dpos, value) if value != nomatch else _nomatch_res
         else:
             return _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        return test.scan(src, spos)
     fn.children = list((test,))
     return fn
 
-def lookahead(name, test, conv, options):
+def pinned(fn):
+    '''fn(src, pos) keeping streaming source data from pos until it
+    returns, even if the cut is passed'''
+    def match(src, pos):
+        if not isinstance(src, InfiniteInput):
+            return fn(src, pos)
+        src.pin(pos)
+        try:
+            return fn(src, pos)
+        finally:
+            src.unpin()
+    return match
+
+def match_capture(name, test, conv, options):
+    '''value is the source slice matched by the test, test is scanned
+    without building its value'''
+    def captured(src, spos):
+        dpos, value = test.scan(src, spos)
+        if value == nomatch:
+            return _nomatch_res
+        value = conv(src[spos:spos + dpos])
+        return (dpos, value) if value != nomatch else _nomatch_res
+
+    #captured data is sliced after the test is scanned
+    fn = rule(name, options)(pinned(captured) if options.is_stream
+                             else captured)
+
+    @fn.scanner
+    def scan(src, spos):
+        return test.scan(src, spos)
+    fn.children = list((test,))
+    return fn
+
+def match_span(name, test, conv, options):
+    '''value is (begin, end) positions of the source matched by the
+    test'''
+    @rule(name, options)
+    def fn(src, spos):
+        dpos, value = test.scan(src, spos)
+        if value == nomatch:
+            return _nomatch_res
+        value = conv((spos, spos + dpos))
+        return (dpos, value) if value != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        return test.scan(src, spos)
+    fn.children = list((test,))
+    return fn
+
+def mk_deferred_node(label, begin, end):
+    def node(value):
+        return Node.of(label, value, begin, end)
+    node.__name__ = label
+    return node
+
+def match_node(name, test_label, conv, options):
+    '''value is Node labeled by the label with items of the test value
+    as children'''
+    test, label = test_label
     @rule(name, options)
     def fn(src, spos):
         try:
             dpos, value = test.match(src, spos)
         except IndexError as e:
             dpos, value = _nomatch_res
+        if value == nomatch:
+            return _nomatch_res
+        if isinstance(value, Deferred):
+            #children are known only after the value is evaluated
+            value = Deferred(mk_deferred_node(label, spos, spos + dpos),
+                             value)
+        else:
+            value = Node.of(label, value, spos, spos + dpos)
+        value = conv(value)
+        return (dpos, value) if value != nomatch else _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        return test.scan(src, spos)
+    fn.children = list((test,))
+    return fn
+
+def lookahead(name, test, conv, options):
+    item = predicate_point(test, options)
+    @rule(name, options)
+    def fn(src, spos):
+        try:
+            dpos, value = item.match(src, spos)
+        except IndexError as e:
+            dpos, value = _nomatch_res
         if value != nomatch:
             value = conv(value)
             return (0, value) if value != nomatch else _nomatch_res
         else:
             return _nomatch_res
+
+    @fn.scanner
+    def scan(src, spos):
+        if item.scan(src, spos)[1] == nomatch:
+            return _nomatch_res
+        return (0, empty)
     fn.children = list((test,))
     return fn
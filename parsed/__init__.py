@@ -7,18 +7,33 @@
 import string
 
 import Generate
+import Parallel
+import Profile
 import Rules
 from Common import *
 
 def rule(fn): return Generate.TopRule(fn)
 
 def char(c): return Generate.mk_first_match_rule(c)
-def text(s): return Generate.StringRule(s)
+def text(s, is_ignore_case = False):
+    return Generate.StringRule(s, is_ignore_case = is_ignore_case)
 def equal(c): return Generate.FirstEqualRule(c)
 
 def match(pred): return Generate.FirstEqualPredRule(pred)
 
+def capture(r):
+    '''value is the source text matched by r instead of r value'''
+    return Generate.CaptureRule(Generate.mk_rule(r))
+def span(r):
+    '''value is (begin, end) positions of the source matched by r'''
+    return Generate.CaptureRule(Generate.mk_rule(r), is_span = True)
+def node(r, label = None):
+    '''value is parse tree Node labeled by the label or the name of r
+    with items of r value as children'''
+    return Generate.NodeRule(Generate.mk_rule(r), label)
+
 anything = Generate.FirstConsumeRule()
+cut = Generate.CutRule()
 
 def __mk_isinstance(cls):
     fn = lambda x: isinstance(x, cls)
@@ -30,10 +45,49 @@ def isa(cls): return match(__mk_isinstance(cls))
 def source(src, begin = 0, end = None):
     return Rules.InfiniteInput(src, begin, end)
 
-def cache_clean(rules_dict):
+def mapped(path):
+    '''read-only memory map of the file, parsed by parser built with
+    mk_options(use_bytes = True) without reading it into memory'''
+    return Rules.mapped(path)
+
+def trace(limit = 10000, names = None, window = None):
+    '''trace buffer keeping limit last events, it is passed as is_trace
+    option value. Only rules named as one of the names and positions
+    in the window (begin, end) are recorded if given'''
+    return Rules.Trace(limit, names, window)
+
+def profile():
+    '''profile gathered by parser if it is passed as is_stat option
+    value, see parsed/Profile.py'''
+    return Profile.Profile()
+
+def memo_report(grammar):
+    '''list of (rule name, is memoized) sorted by name: rules chosen to
+    be memoized by memo_select = 'auto' option for the grammar rule or
+    the parser built by it'''
+    top = grammar if isinstance(grammar, Generate.Rule) \
+          else getattr(grammar, 'grammar', None)
+    if top is None:
+        raise Generate.Err("{} is not the rule or parser", grammar)
+    return Generate.MemoSelection(top).report
+
+def parse_file(path, grammar, boundary, options = None, processes = None,
+               chunk_size = 1024 * 1024):
+    '''list of values of the file ranges split after the boundary
+    (string or rule) and parsed by grammar(options) in the pool of
+    processes, see parsed/Parallel.py'''
+    return Parallel.parse_file(path, grammar, boundary, options,
+                               processes, chunk_size)
+
+def incremental(parser, text):
+    return Rules.Incremental(parser, text)
+
+def cache_clean(rules_dict = None):
     '''rules_dict is ordinary result of grammar module globals()
-    call'''
-    for x in rules_dict.values():
+    call, parsers of all rules are dropped if it is None'''
+    rules = list(Generate.built_rules) if rules_dict is None \
+            else rules_dict.values()
+    for x in rules:
         if isinstance(x, Generate.Rule):
             x.parser_cache_reset()
 
@@ -73,12 +127,9 @@ def ascii():
 def ascii_digit(): return ascii | digit_dec
 
 def within(begin, end):
-    def check(c):
-        i = ord(c)
-        return i >= begin and i <= end
     @rule
     def fn():
-        return char(check) > value
+        return Generate.FirstEqualRangeRule((begin, end)) > value
     fn.name = '?[{}, {}]'.format(begin, end)
     return fn
 
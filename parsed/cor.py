@@ -124,12 +124,28 @@ def escape_str(s):
 def wrap(wrapper, s):
     return ''.join([wrapper, s, wrapper])
 
+def frozen(v):
+    '''hashable copy of v made of nested lists, sets and dicts'''
+    if isinstance(v, (list, tuple)):
+        return tuple(frozen(x) for x in v)
+    if isinstance(v, (set, frozenset)):
+        return frozenset(frozen(x) for x in v)
+    if isinstance(v, dict):
+        return frozenset((k, frozen(x)) for k, x in v.items())
+    if isinstance(v, staticmethod):
+        return v.__func__
+    return v
+
 class Options(object):
     def __init__(self, **kwargs):
         self.__options = kwargs
+        self.__frozen = None
 
     def __getattr__(self, name):
-        return self.__options[name]
+        try:
+            return self.__options[name]
+        except KeyError:
+            raise AttributeError(name)
 
     def __setattr__(self, name, value):
         if name.startswith('_Options__'):
@@ -137,16 +153,39 @@ class Options(object):
         else:
             value = staticmethod(value) if is_function(value) else value
             self.__options[name] = value
+            self.__frozen = None
 
     def __dir__(self):
         return self.__options.keys()
 
     def update(self, src):
+        self.__frozen = None
         return self.__options.update(src)
 
+    def frozen(self):
+        '''hashable value equal for equal options'''
+        if self.__frozen is None:
+            self.__frozen = frozen(self.__options)
+        return self.__frozen
+
     def copy(self):
         return Options(**dict(self.__options))
 
+    def __getstate__(self):
+        # staticmethod wrappers can't be pickled
+        options = self.__options
+        wrapped = [k for k, v in options.items()
+                   if isinstance(v, staticmethod)]
+        return (dict(options, **dict((k, options[k].__func__)
+                                     for k in wrapped)), wrapped)
+
+    def __setstate__(self, state):
+        options, wrapped = state
+        for k in wrapped:
+            options[k] = staticmethod(options[k])
+        self.__options = options
+        self.__frozen = None
+
     def __eq__(self, other):
         return isinstance(other, Options) \
             and self.__options == other.__options
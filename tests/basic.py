@@ -6,7 +6,9 @@
 
 import unittest
 from parsed import *
+import parsed.Generate as Generate
 import parsed.Rules as Rules
+from parsed.cor import Err
 
 
 class TestRulesGeneration(unittest.TestCase):
@@ -50,6 +52,32 @@ class TestRulesGeneration(unittest.TestCase):
         r4 = self.char_generator(mk_options(is_remember = False))
         self.assertIs(r4, r3)
 
+    def test_generator_configurations(self):
+        r = self.char_generator(mk_options())
+        r2 = self.char_generator(mk_options(use_unicode = True))
+        self.assertIsNot(r2, r)
+        self.assertIs(self.char_generator(mk_options()), r)
+        self.assertIs(self.char_generator(mk_options(use_unicode = True)), r2)
+        self.assertEqual(mk_options(memo_select = ['a']).frozen(),
+                         mk_options(memo_select = ['a']).frozen())
+
+        @rule
+        def word(): return spaces + char('ab')[1:] > first
+        @rule
+        def words(): return word[0:] + spaces
+        s = spaces(mk_options())
+        p = word(mk_options())
+        words(mk_options(use_unicode = True))
+        self.assertEqual(words(mk_options()).parse(' ab b '),
+                         (6, [[['a', 'b'], ['b']]]))
+        #predefined rule parser is shared by grammars with same options
+        self.assertIs(spaces(mk_options()), s)
+        self.assertIs(word(mk_options()), p)
+
+        cache_clean()
+        self.assertIsNot(self.char_generator(mk_options()), r)
+        self.assertIsNot(word(mk_options()), p)
+
 
 class MatchTestBase(unittest.TestCase):
 
@@ -242,6 +270,301 @@ class TestWithin(MatchTestBase):
         self.basic_match(self.a, 'cde', (1, 'ac'))
         self.basic_match(self.a, '-bcd', (0, nomatch))
 
+class TestCharClass(MatchTestBase):
+
+    def setUp(self):
+        @rule
+        def lower(): return within(ord('a'), ord('z'))
+        @rule
+        def name_char(): return lower | '_' | char('-.') \
+            | within(0x400, 0x4ff) > value
+        @rule
+        def name(): return name_char[1:] > list2str
+        @rule
+        def mixed(): return lower | text('01') > value
+        self.name_char = name_char
+        self.name = name
+        self.mixed = mixed
+
+    def test_fold(self):
+        chars = self.name_char.expand().chars
+        self.assertIsInstance(chars, Rules.CharClass)
+        self.assertEqual(chars.ranges, ((ord('-'), ord('.')),
+                                        (ord('_'), ord('_')),
+                                        (ord('a'), ord('z')),
+                                        (0x400, 0x4ff)))
+        self.assertEqual(self.mixed.expand().chars, None)
+        self.assertNotIsInstance(self.name_char(), Rules.CachingRule)
+
+    def test_match(self):
+        self.basic_match(self.name, 'ab_c.d-e f', (8, 'ab_c.d-e'))
+        self.basic_match(self.name, u'aфb', (3, u'aфb'),
+                         mk_options(use_unicode = True))
+        self.basic_match(self.name, '', (0, nomatch))
+        self.basic_match(self.name, ['a', 'bc'], (1, 'a'))
+        self.basic_match(self.mixed, '01', (2, '01'))
+
+    def test_small(self):
+        chars = Rules.CharClass([(1, 3), (5, 5), (4, 4), (10, 12)])
+        self.assertEqual(chars.ranges, ((1, 5), (10, 12)))
+        self.assertEqual([x for x in xrange(14) if unichr(x) in chars],
+                         [1, 2, 3, 4, 5, 10, 11, 12])
+        chars = Rules.CharClass([(0x100, 0x2000), (0x10, 0x20)])
+        self.assertEqual(chars.codes, None)
+        self.assertIn(u'\u1000', chars)
+        self.assertNotIn(u'\u2001', chars)
+        self.assertNotIn(empty, chars)
+
+class TestDispatch(MatchTestBase):
+
+    def setUp(self):
+        self.tried = []
+        def tried(x):
+            self.tried.append(x)
+            return x == 'x'
+        @rule
+        def number(): return char('-')[0:1] + char('0123')[1:] > value
+        @rule
+        def word(): return text('ab') + text('c') > value
+        @rule
+        def probe(): return char(tried) + 'y' > value
+        @rule
+        def item(): return number | word | probe | char(' ')[0:] + eof \
+            > value
+        self.number = number
+        self.item = item
+
+    def test_first_set(self):
+        ranges, is_nullable = Generate.first_set(self.number)
+        self.assertEqual(Rules.CharClass(ranges).ranges,
+                         ((ord('-'), ord('-')), (ord('0'), ord('3'))))
+        self.assertFalse(is_nullable)
+        firsts = self.item.expand().firsts
+        self.assertEqual(firsts[1].ranges, ((ord('a'), ord('a')),))
+        self.assertEqual(firsts[2], None)
+        self.assertEqual(firsts[3].ranges, ((ord(' '), ord(' ')),))
+        self.assertEqual(Generate.first_set(text('')), ([], True))
+
+    def test_match(self):
+        options = mk_options(use_regex = False)
+        self.basic_match(self.item, '01', (2, [['0', '1']]), options)
+        self.assertEqual(self.tried, [])
+        self.basic_match(self.item, 'abc', (3, ['ab', 'c']), options)
+        self.basic_match(self.item, 'xy', (2, ['x']), options)
+        self.basic_match(self.item, '  ', (3, [[]]), options)
+        self.basic_match(self.item, '', (1, [[]]), options)
+        self.basic_match(self.item, ['a', 'b'], (0, nomatch), options)
+
+class TestLiterals(MatchTestBase):
+
+    def setUp(self):
+        @rule
+        def end(): return text('END:') > (lambda x: x.lower())
+        @rule
+        def keyword(): return text('BEGIN:') | end | text('BEGIN') \
+            | text('x', is_ignore_case = True) | text('xml') > value
+        @rule
+        def item(): return keyword + char(' ')[0:] > first
+        self.keyword = keyword
+        self.item = item
+
+    def test_trie(self):
+        literals = Rules.Literals([('ab', False), ('a', False),
+                                   ('AB', True), ('', False)])
+        self.assertEqual(literals.length, 2)
+        self.assertEqual(literals.find('xabc', 1), [(0, 2), (1, 1),
+                                                (2, 2), (3, 0)])
+        self.assertEqual(literals.find('Ab'), [(2, 2), (3, 0)])
+        self.assertEqual(literals.find(''), [(3, 0)])
+
+    def test_match(self):
+        self.assertEqual(len(self.keyword.expand().literals), 5)
+        self.basic_match(self.keyword, 'BEGIN:', (6, 'BEGIN:'))
+        self.basic_match(self.keyword, 'BEGIN', (5, 'BEGIN'))
+        self.basic_match(self.keyword, 'END:', (4, 'end:'))
+        self.basic_match(self.keyword, 'XML', (1, 'X'))
+        self.basic_match(self.keyword, 'EN', (0, nomatch))
+        self.basic_match(self.keyword, ['x'], (0, nomatch))
+        self.basic_match(self.item, u'xml ', (1, u'x'),
+                         mk_options(use_unicode = True))
+
+    def test_in_place(self):
+        @rule
+        def ab(): return text('ab') > value
+        self.basic_match(ab, 'abc', (2, 'ab'))
+        self.basic_match(ab, 'bab', (0, nomatch))
+        self.basic_match(ab, bytearray('abc'), (2, 'ab'))
+        self.basic_match(ab, bytearray('a'), (0, nomatch))
+        res = ab().parse(u'ab')
+        self.assertEqual(res, (2, u'ab'))
+        self.assertIsInstance(res[1], unicode)
+        self.basic_match(ab, ['a', 'b'], (0, nomatch))
+
+    def test_ignore_case(self):
+        @rule
+        def word(): return text('Begin', is_ignore_case = True) > value
+        self.basic_match(word, 'bEGIN:', (5, 'bEGIN'))
+        self.basic_match(word, 'BEGI', (0, nomatch))
+
+class TestRecognize(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        def count(x):
+            self.calls += 1
+            return x
+        @rule
+        def word(): return char('abc')[1:] > count
+        @rule
+        def number(): return char('-')[0:1] + char('0123')[1:3] > count
+        @rule
+        def keyword(): return text('if') | text('in') \
+            | text('Do', is_ignore_case = True) > count
+        @rule
+        def item(): return spaces + (~keyword + word | number | keyword
+                                     | '(' + cut + item[0:] + spaces + ')') \
+                                     > count
+        @rule
+        def items(): return item[0:] + spaces & eof > count
+        self.items = items
+
+    def test_same_length(self):
+        sources = ['', 'ab (c 12) if', '(a -1 (in)) do', 'ab -', '(a',
+                   'ifa', '-0123', '(a ())) b']
+        for options in (mk_options(), mk_options(is_remember = False),
+                        mk_options(use_regex = False),
+                        mk_options(memo = 'window', memo_limit = 3)):
+            p = self.items(options)
+            for src in sources:
+                pos, value = p.parse(src)
+                self.calls = 0
+                self.assertEqual(p.recognize(src),
+                                 pos if value != nomatch else None, src)
+                self.assertEqual(self.calls, 0)
+
+    def test_actions(self):
+        @rule
+        def odd(): return char('0123')[1:] \
+            > (lambda x: x if len(x) % 2 else nomatch)
+        p = odd()
+        self.assertEqual(p.parse('01'), (0, nomatch))
+        self.assertEqual(p.recognize('01'), 2)
+        self.assertEqual(p.recognize('x'), None)
+
+class TestCapture(MatchTestBase):
+
+    def setUp(self):
+        self.calls = 0
+        def count(x):
+            self.calls += 1
+            return x
+        @rule
+        def quoted():
+            return '"' + capture((~char('"') + any_char > count)[0:]) \
+                + '"' > first
+        @rule
+        def word(): return spaces + span(char('abc')[1:]) > first
+        self.quoted = quoted
+        self.word = word
+
+    def test_match(self):
+        self.basic_match(self.quoted, '"ab c"', (6, 'ab c'))
+        self.basic_match(self.quoted, '""', (2, ''))
+        self.basic_match(self.quoted, '"ab', (0, nomatch))
+        self.assertEqual(self.calls, 0)
+        self.basic_match(self.word, '  abx', (4, (2, 4)))
+        self.basic_match(self.word, '  x', (0, nomatch))
+
+    def test_sources(self):
+        res = self.quoted().parse(u'"ф"')
+        self.assertEqual(res, (3, u'ф'))
+        self.assertIsInstance(res[1], unicode)
+        self.assertEqual(self.quoted().parse(list('"ab"')), (4, ['a', 'b']))
+
+    def test_memo(self):
+        def is_alpha(c): return c != empty and c.isalpha()
+        @rule
+        def word(): return char(is_alpha)[1:] > list2str
+        #word scanned by failed capture is matched by the next alternative
+        @rule
+        def item(): return (capture(word) + '!') | (word + '?')
+        self.basic_match(item, 'abc?', (4, ['abc']))
+        self.basic_match(item, 'abc!', (4, ['abc']))
+        self.basic_match(item, 'abc?', (4, ['abc']),
+                         mk_options(memo = 'lru', memo_limit = 2))
+
+class TestDeferred(unittest.TestCase):
+
+    def setUp(self):
+        self.made = []
+        def make(x):
+            self.made.append(x)
+            return x.upper()
+        @rule
+        def word(): return char('abc')[1:] > (lambda x: make(list2str(x)))
+        @rule
+        def call(): return word + '(' + word + ')' > value
+        @rule
+        def item(): return call | word + '(' + char('abc')[1:] > value
+        @rule
+        def items(): return item + (char(' ') + item > first)[0:] > value
+        self.items = items
+
+    def test_winning(self):
+        eager = self.items().parse('ab(c a(b)')
+        self.assertEqual(self.made, ['ab', 'c', 'a', 'b'])
+        self.made = []
+        p = self.items(mk_options(is_deferred = True))
+        self.assertEqual(p.parse('ab(c a(b)'), eager)
+        self.assertEqual(self.made, ['ab', 'a', 'b'])
+        self.assertEqual(p.parse('x'), (0, nomatch))
+
+    def test_rejected(self):
+        @rule
+        def odd(): return char('0123')[1:] \
+            > (lambda x: x if len(x) % 2 else nomatch)
+        self.assertEqual(odd(mk_options(is_deferred = True)).parse('1'),
+                         (1, ['1']))
+        self.assertRaises(Err, odd(mk_options(is_deferred = True)).parse,
+                          '12')
+        #IndexError raised by the action is the rejection too
+        @rule
+        def third(): return char('0123')[1:] > (lambda x: x[2])
+        @rule
+        def item(): return third | char('x') > value
+        self.assertEqual(item().parse('12'), (0, nomatch))
+        p = item(mk_options(is_deferred = True))
+        self.assertEqual(p.parse('123'), (3, '3'))
+        self.assertRaises(Err, p.parse, '12')
+
+class TestNode(MatchTestBase):
+
+    def setUp(self):
+        @rule
+        def word(): return capture(char('abc')[1:])
+        @rule
+        def alist(): return node('(' + (spaces + (word | alist) > first)[0:]
+                                 + spaces + ')' > first, 'list')
+        self.word = word
+        self.alist = alist
+
+    def test_match(self):
+        self.basic_match(self.alist, '(ab (c) ())', (11, Node('list', (
+            'ab', Node('list', ('c',), 4, 7), Node('list', (), 8, 10)),
+                                                              0, 11)))
+        self.basic_match(node(self.word), 'ab', (2, Node('word', ('ab',),
+                                                          0, 2)))
+        self.basic_match(self.alist, '(a', (0, nomatch))
+        src = '(a (b))'
+        pos, value = self.alist().parse(src)
+        self.assertEqual(src[slice(*value.children[1].span)], '(b)')
+        self.assertRaises(AttributeError, setattr, value, 'x', 1)
+
+    def test_deferred(self):
+        src = '(ab (c) ((a)))'
+        self.assertEqual(self.alist(mk_options(is_deferred = True)).parse(src),
+                         self.alist().parse(src))
+
 class TestDefault(MatchTestBase):
 
     def test_vspace(self):
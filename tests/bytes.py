@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import os
+import shutil
+import tempfile
+import unittest
+from parsed import *
+import parsed.Generate as Generate
+from parsed.cor import Err
+
+
+class TestBytes(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        @rule
+        def key(): return within(ord('a'), ord('z'))[1:] > list2str
+        @rule
+        def val(): return (~char('\n;') + any_char > first)[0:] > list2str
+        @rule
+        def mark(): return text(u'→') | text('=') > value
+        @rule
+        def pair(): return key + mark + val + char(';\n') > value
+        @rule
+        def pairs(): return pair[0:] + eof > first
+        self.pairs = pairs
+        self.options = mk_options(use_bytes = True)
+        self.data = u'ab=1;cd→xyz\nef=é\n'.encode('utf-8')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data):
+        path = os.path.join(self.dir, 'data')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_sources(self):
+        p = self.pairs(self.options)
+        expected = p.parse(self.data)
+        self.assertEqual(expected[0], len(self.data) + 1)
+        self.assertEqual(expected[1][1],
+                         ['cd', u'→'.encode('utf-8'), 'xyz', '\n'])
+        src = mapped(self.write(self.data))
+        try:
+            self.assertEqual(p.parse(src), expected)
+        finally:
+            src.close()
+        self.assertEqual(p.parse(memoryview(self.data)), expected)
+        self.assertEqual(p.parse(bytearray(self.data)), expected)
+        p = self.pairs(mk_options(use_bytes = True, use_regex = False))
+        self.assertEqual(p.parse(bytearray(self.data)), expected)
+        self.assertEqual(p.parse(mapped(self.write(''))), (1, []))
+
+    def test_dispatch(self):
+        @rule
+        def item(): return (text(u'é') + char('a')) | (char('b') + char('c'))
+        ranges, is_nullable = Generate.first_set(item, self.options)
+        self.assertEqual(ranges, [(0xc3, 0xc3), (ord('b'), ord('b'))])
+        for options in (self.options,
+                        mk_options(use_bytes = True, use_regex = False)):
+            p = item(options)
+            self.assertEqual(p.parse(u'éa'.encode('utf-8')),
+                             (3, [u'é'.encode('utf-8')]))
+            self.assertEqual(p.parse('bc')[0], 2)
+            self.assertEqual(p.parse('c'), (0, nomatch))
+
+    def test_buffers(self):
+        @rule
+        def keyword(): return text('ab') | text('cd') \
+            | text('Ef', is_ignore_case = True) > value
+        @rule
+        def keywords(): return keyword[0:] > value
+        for options in (mk_options(), mk_options(use_regex = False),
+                        self.options):
+            p = keywords(options)
+            for src in (bytearray('abeFcd'), memoryview('abeFcd')):
+                self.assertEqual(p.parse(src), (6, ['ab', 'eF', 'cd']))
+            self.assertEqual(p.parse(bytearray('abx')), (2, ['ab']))
+        @rule
+        def tag(): return text('XML', is_ignore_case = True) > value
+        for src in (bytearray('xMl'), memoryview('xMl')):
+            self.assertEqual(tag().parse(src), (3, 'xMl'))
+        self.assertEqual(tag().parse(bytearray('xm')), (0, nomatch))
+
+    def test_buffer_chars(self):
+        @rule
+        def word(): return (char('a') + char('bc') + char(str.isdigit)
+                            + ~char('x') + any_char > value)[0:]
+        for options in (mk_options(), mk_options(use_regex = False),
+                        self.options):
+            p = word(options)
+            self.assertEqual(p.parse(bytearray('ab1ya')),
+                             (4, [['b', '1', 'y']]))
+            self.assertEqual(p.parse(bytearray('ac2x')), (0, []))
+
+    def test_int_items(self):
+        #items of other sources are not converted
+        @rule
+        def pair(): return any_char + any_char > value
+        @rule
+        def number(): return char('ab') + char(lambda x: isinstance(x, int)) \
+            > value
+        for options in (mk_options(), mk_options(use_regex = False),
+                        self.options):
+            self.assertEqual(pair(options).parse([65, 'x']), (2, [65, 'x']))
+            self.assertEqual(pair(options).parse([1000, 5]), (2, [1000, 5]))
+            self.assertEqual(number(options).parse(['a', 7]), (2, ['a', 7]))
+
+    def test_options(self):
+        self.assertRaises(Err, self.pairs,
+                          mk_options(use_bytes = True, use_unicode = True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import os
+import shutil
+import tempfile
+import unittest
+from parsed import *
+from parsed import Compile, Memo
+from parsed.cor import Err
+
+
+class CompileTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def compiled(self, gen, options = mk_options(), **env):
+        path = os.path.join(self.dir, 'gen_{}.py'.format(gen.name))
+        Compile.write(gen, path, options)
+        return Compile.load(path, **env)
+
+    def same_match(self, gen, sources, options = mk_options(), **env):
+        p = gen(options)
+        c = self.compiled(gen, options, **env)
+        for src in sources:
+            self.assertEqual(c.parse(src), p.parse(src))
+
+class TestCompile(CompileTestBase):
+
+    def setUp(self):
+        super(TestCompile, self).setUp()
+        @rule
+        def sign(): return char('+-')[:1] > \
+                (lambda x: '+' if x == empty else x)
+        @rule
+        def number(): return sign + digit_dec[1:] > \
+                (lambda x: int(''.join([x[0], list2str(x[1])])))
+        @rule
+        def name(): return within(ord('a'), ord('z'))[1:] > list2str
+        @rule
+        def dquoted(): return '"' + (~char('"') + any_char > first)[0:] \
+            + '"' > (lambda x: list2str(x[0]))
+        @rule
+        def item(): return spaces + (number | name | dquoted | alist) > first
+        @rule
+        def alist(): return '(' + item[0:] + spaces + ')' > first
+        @rule
+        def pair(): return item + item & eof
+
+        self.alist = alist
+        self.pair = pair
+
+    def test_same_results(self):
+        sources = ['()', '(1 -2 +3)', '(a (b "c d") ())', '(1 2 3 4)',
+                   '((((x))))', '(ab"q")', '("x']
+        self.same_match(self.alist, sources)
+        self.same_match(self.alist, sources, mk_options(is_remember = False))
+        self.same_match(self.pair, ['1 2', '1 2 3', 'a"b"', '1)'])
+        self.same_match(self.alist, [bytearray(x) for x in sources])
+        self.assertEqual(self.compiled(self.alist).parse(bytearray('(a 1)')),
+                         (5, ['a', 1]))
+
+    def test_int_items(self):
+        @rule
+        def pair(): return any_char + any_char > value
+        self.same_match(pair, [[65, 'x'], [1000, 5], bytearray('ab')])
+        self.assertEqual(self.compiled(pair).parse([65, 'x']), (2, [65, 'x']))
+
+    def test_unicode(self):
+        self.same_match(self.alist, [u'(a "ф" 1)'],
+                        mk_options(use_unicode = True))
+
+    def test_literals(self):
+        @rule
+        def keyword(): return text('ab') | text('a') \
+            | text('Cd', is_ignore_case = True) > value
+        @rule
+        def keywords(): return keyword[0:] > value
+        self.same_match(keywords, ['aab', 'abcD', 'cDAB', 'x', ''])
+        self.same_match(keywords, [bytearray('abcD'), memoryview('cDab')])
+        self.assertEqual(self.compiled(keywords).parse(bytearray('abcD')),
+                         (4, ['ab', 'cD']))
+
+    def test_capture(self):
+        @rule
+        def item(): return spaces + capture(char('ab')[1:]) \
+            + span(char('12')[0:]) > value
+        self.same_match(item, [' ab12', 'b', '1'])
+
+    def test_node(self):
+        @rule
+        def word(): return node(char('ab')[1:] > list2str, 'word')
+        @rule
+        def words(): return node((spaces + word > first)[0:])
+        self.same_match(words, [' ab b', '', 'x'])
+
+    def test_cut(self):
+        @rule
+        def choice(): return 'x' + cut + 'y' | text('xz') > value
+        self.same_match(choice, ['xy', 'xz', 'z'])
+        @rule
+        def record(): return 'B' + cut + char('0123')[0:] + 'E' > first
+        @rule
+        def records(): return record[0:] > value
+        self.same_match(records, ['B1EB23E', 'B1EB2', 'B1EX', ''])
+        @rule
+        def probe(): return -('x' + cut + 'y') + text('xy') \
+            | text('xz') > value
+        self.same_match(probe, ['xz', 'xy'])
+        committed = char('a') + cut
+        @rule
+        def passed(): return (-committed + committed + 'x') | char('a')
+        for options in (mk_options(), mk_options(is_remember = False)):
+            self.same_match(passed, ['ab', 'ax'], options)
+            self.assertEqual(self.compiled(passed, options).parse('ab'),
+                             (0, nomatch))
+
+    def test_env(self):
+        class Ctx(object):
+            pass
+        def grammar(ctx):
+            @rule
+            def a():
+                return (char('a') > value)[1:] > (lambda x: ctx.fn(len(x)))
+            return a
+        gen = grammar(Ctx)
+        Ctx.fn = staticmethod(lambda x: x * 2)
+        self.assertRaises(Err, self.compiled, gen)
+        c = self.compiled(gen, ctx = Ctx)
+        self.assertEqual(c.ENV, ('ctx',))
+        self.assertEqual(c.parse('aaa'), (3, 6))
+        self.assertEqual(c.parse('b'), (0, nomatch))
+
+    def test_dump(self):
+        path = os.path.join(self.dir, 'alist.bin')
+        sources = ['(1 (a "b"))', '(x']
+        for options in (mk_options(), mk_options(is_remember = False)):
+            p = self.alist(options)
+            Compile.dump(p, path)
+            c = Compile.load(path)
+            self.assertEqual(len(c._memos) > 0, options.is_remember)
+            for src in sources:
+                self.assertEqual(c.parse(src), p.parse(src))
+        with open(path, 'r+b') as f:
+            f.seek(len('parsed\0'))
+            f.write('\0')
+        self.assertRaises(Err, Compile.load, path)
+        self.assertRaises(Err, Compile.source, object())
+
+    def test_memo_policy(self):
+        path = os.path.join(self.dir, 'alist.bin')
+        for memo in ('lru', 'window', Memo.Budget):
+            options = mk_options(memo = memo, memo_limit = 16)
+            self.assertRaises(Err, Compile.dump, self.alist(options), path)
+            self.assertRaises(Err, self.compiled, self.alist, options)
+            options.is_remember = False
+            self.same_match(self.alist, ['(a 1)'], options)
+        self.same_match(self.alist, ['(a 1)'],
+                        mk_options(memo = Memo.Dense, memo_limit = 16))
+
+    def test_options(self):
+        for name in ('is_trace', 'is_stat', 'is_stream', 'is_deferred',
+                     'is_incremental'):
+            self.assertRaises(Err, self.compiled, self.alist,
+                              mk_options(**{name: True}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import unittest
+from StringIO import StringIO
+from parsed import *
+import parsed.Generate as Generate
+import parsed.Rules as Rules
+
+
+class TestCut(unittest.TestCase):
+
+    def test_choice(self):
+        @rule
+        def committed(): return 'x' + cut + 'y' | text('xz') > value
+        @rule
+        def free(): return text('x') + 'y' | text('xz') > value
+        self.assertEqual(committed().parse('xy')[0], 2)
+        self.assertEqual(committed().parse('xz'), (0, nomatch))
+        self.assertEqual(free().parse('xz'), (2, 'xz'))
+
+    def test_repetition(self):
+        @rule
+        def record(): return 'B' + cut + char('0123')[0:] + 'E' > first
+        @rule
+        def records(): return record[0:] > value
+        p = records()
+        self.assertEqual(p.parse('B1EB23E'), (7, [['1'], ['2', '3']]))
+        self.assertEqual(p.parse('B1EB2'), (0, nomatch))
+        self.assertEqual(p.parse('B1EX'), (3, [['1']]))
+
+    def test_predicate(self):
+        @rule
+        def probe(): return -('x' + cut + 'y') + text('xy') \
+            | text('xz') > value
+        self.assertEqual(probe().parse('xz'), (2, 'xz'))
+        self.assertEqual(probe().parse('xy')[0], 2)
+
+    def test_committing(self):
+        @rule
+        def record(): return 'B' + cut + 'E' > value
+        @rule
+        def item(): return record | 'X' > value
+        @rule
+        def other(): return char('ab') | 'c' > value
+        rules = Generate.committing(item)
+        self.assertIn(record, rules)
+        self.assertIn(item.expand(), rules)
+        self.assertFalse(Generate.committing(other))
+
+    def test_memo(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def record(): return '(' + cut + word + ')' | word > first
+        @rule
+        def records(): return record[0:] > value
+        src = '(ab)(ba)(a)'
+        self.assertEqual(records().parse(src), (len(src), ['ab', 'ba', 'a']))
+        memo = word().memo
+        self.assertEqual(memo.get(1), None)
+        self.assertEqual(memo.get(9), (1, 'a'))
+
+    def test_memo_hit(self):
+        #cut of the rule matched by lookahead is passed again
+        committed = char('a') + cut
+        @rule
+        def probe(): return (-committed + committed + 'x') | char('a')
+        for options in (mk_options(), mk_options(is_remember = False)):
+            self.assertEqual(probe(options).parse('ab'), (0, nomatch))
+            self.assertEqual(probe(options).parse('ax')[0], 2)
+
+    def test_stream(self):
+        @rule
+        def record(): return 'B' + cut + char('0123')[0:] + 'E' > first
+        @rule
+        def records(): return record[0:] > value
+        data = 'B0123E' * 100
+        p = records(mk_options(is_stream = True))
+        src = Rules.InfiniteInput(StringIO(data), chunk_size = 8)
+        self.assertEqual(p.parse(src)[0], len(data))
+        self.assertTrue(src.begin > len(data) - 16)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import random
+import unittest
+from parsed import *
+from parsed.cor import Err
+import parsed.Memo as Memo
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        def count(x):
+            self.calls += 1
+            return list2str(x)
+        @rule
+        def word(): return char('abc')[1:] > count
+        @rule
+        def item(): return spaces + (word | alist) > first
+        @rule
+        def alist(): return '(' + item[0:] + spaces + ')' > first
+        @rule
+        def top(): return item[0:] + spaces & eof > first
+
+        self.top = top
+        self.options = mk_options(is_incremental = True)
+
+    def fresh(self, text):
+        return self.top().parse(text)
+
+    def test_edit(self):
+        text = ' '.join(['(ab (c a))'] * 50)
+        doc = incremental(self.top(self.options), text)
+        self.assertEqual(doc.parse(), self.fresh(text))
+        for offset, removed, inserted in ((len(text) - 2, 1, 'cc'),
+                                          (3, 0, ' b')):
+            self.calls = 0
+            res = doc.edit(offset, removed, inserted)
+            self.assertTrue(self.calls < 5, self.calls)
+            self.assertEqual(res, self.fresh(doc.text))
+        self.assertEqual(doc.text, '(ab b' + text[3:-2] + 'cc)')
+
+    def test_random(self):
+        rnd = random.Random(1)
+        text = '(ab c) (a (b c)) abc'
+        doc = incremental(self.top(self.options), text)
+        doc.parse()
+        for i in xrange(200):
+            offset = rnd.randint(0, len(doc.text))
+            removed = rnd.randint(0, min(3, len(doc.text) - offset))
+            inserted = ''.join(rnd.choice('abc () ')
+                               for x in xrange(rnd.randint(0, 3)))
+            res = doc.edit(offset, removed, inserted)
+            self.assertEqual(res, self.fresh(doc.text), doc.text)
+
+    def test_blocks(self):
+        #entries are moved into the new block behind the tracked ones
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def item(): return word + ';' > first
+        @rule
+        def doc(): return item[0:] + eof > first
+        text = 'a;' * 126 + 'ab;'
+        inc = incremental(doc(self.options), text)
+        inc.parse()
+        inc.edit(0, 0, 'a;a;')
+        self.assertEqual(inc.edit(257, 1, 'a'), doc().parse(inc.text))
+
+        rnd = random.Random(2)
+        text = ' '.join(['(ab (c a))'] * 30)
+        inc = incremental(self.top(self.options), text)
+        inc.parse()
+        for i in xrange(100):
+            offset = rnd.randint(0, len(inc.text))
+            removed = rnd.randint(0, min(70, len(inc.text) - offset))
+            inserted = ''.join(rnd.choice('abc () ')
+                               for x in xrange(rnd.randint(0, 70)))
+            res = inc.edit(offset, removed, inserted)
+            self.assertEqual(res, self.fresh(inc.text), inc.text)
+
+    def test_options(self):
+        self.assertRaises(Err, self.top, mk_options(
+            is_incremental = True, memo = 'lru', memo_limit = 2))
+        p = self.top(self.options)
+        self.assertRaises(Err, p.parse, 'a')
+
+    def test_table(self):
+        memo = Memo.Revisable()
+        col = memo.column(0, Memo.policy(self.options))
+        col.put(1, (2, 'ab'), 3)
+        col.put(10, (1, 'a'), 1)
+        memo.reached(1, 4)
+        memo.reached(10, 11)
+        memo.edit(3, 1, 2)
+        self.assertEqual(col.get(1), None)
+        self.assertEqual(col.get(11), (1, 'a'))
+        memo.edit(0, 0, 1)
+        self.assertEqual(col.get(12), (1, 'a'))
+
+if __name__ == '__main__':
+    unittest.main()
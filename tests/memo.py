@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import unittest
+from parsed import *
+from parsed.cor import Err
+import parsed.Memo as Memo
+import parsed.Generate as Generate
+import parsed.Rules as Rules
+
+
+class TestPolicies(unittest.TestCase):
+
+    def setUp(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def item(): return word + ';' | word + ',' | word > value
+        @rule
+        def items(): return item[0:] > value
+
+        self.word = word
+        self.items = items
+        self.src = 'ab;ba,aab' * 20
+
+    def parse(self, **kwargs):
+        #word is not fused to check its memo
+        kwargs.setdefault('use_regex', False)
+        p = self.items(mk_options(**kwargs))
+        return p.parse(self.src)
+
+    def test_same_result(self):
+        expected = self.parse()
+        self.assertEqual(expected[0], len(self.src))
+        self.assertEqual(self.parse(memo = 'lru', memo_limit = 2), expected)
+        self.assertEqual(self.parse(memo = 'window', memo_limit = 1), expected)
+        self.assertEqual(self.parse(memo = 'bytes', memo_limit = 200), expected)
+        self.assertEqual(self.parse(memo = Memo.Lru, memo_limit = 1), expected)
+
+    def test_bounded(self):
+        self.parse(memo = 'lru', memo_limit = 3)
+        memo = self.word(mk_options(
+            use_regex = False, memo = 'lru', memo_limit = 3)).memo
+        self.assertEqual(len(memo), 3)
+
+        self.parse(memo = 'window', memo_limit = 4)
+        memo = self.word(mk_options(
+            use_regex = False, memo = 'window', memo_limit = 4)).memo
+        self.assertTrue(all(x >= memo.furthest - 4 for x in memo.keys()))
+
+        self.parse(memo = 'bytes', memo_limit = 500)
+        memo = self.word(mk_options(
+            use_regex = False, memo = 'bytes', memo_limit = 500)).memo
+        self.assertTrue(0 < memo.size <= 500)
+
+    def test_options(self):
+        self.assertRaises(Err, self.parse, memo = 'lru')
+        self.assertRaises(Err, self.parse, memo = 'unknown', memo_limit = 1)
+
+class TestTable(unittest.TestCase):
+
+    def test_dense(self):
+        col = Memo.Dense(size = 10)
+        self.assertEqual(col.get(3), None)
+        col.put(3, (2, 'ab'))
+        col.put(5, (0, nomatch))
+        self.assertEqual(col.get(3), (2, 'ab'))
+        self.assertEqual(col.get(5), (0, nomatch))
+        self.assertEqual(len(col), 2)
+        self.assertEqual(list(col.lengths[3:6]),
+                         [2, Memo.Dense.unknown, Memo.Dense.failed])
+        self.assertEqual(len(col.lengths), 10)
+
+    def test_per_parse(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def words(): return (word + ' ' > first)[0:] > value
+        p = words(mk_options(use_regex = False))
+        self.assertEqual(p.parse('ab ba '), (6, ['ab', 'ba']))
+        memo = Rules.CachingRule._memo
+        word_id = word(mk_options(use_regex = False)).id
+        self.assertEqual(memo.column(word_id, None).get(3), (2, 'ba'))
+        self.assertTrue(memo.entries > 0)
+        self.assertTrue(memo.size > 0)
+        self.assertEqual(p.parse('a'), (0, []))
+        self.assertIsNot(Rules.CachingRule._memo, memo)
+
+    def test_reset(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def item(): return word + ';' | word > value
+        p = item()
+        for src in ('ab;', 'ba', 'b;', 'aab'):
+            self.assertEqual(p.parse(src)[0], len(src))
+        p.parse('ab')
+        p.cache_clear()
+        self.assertEqual(word().memo.get(0), None)
+
+class TestSelection(unittest.TestCase):
+
+    def setUp(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def sep(): return char(';,') > value
+        @rule
+        def item(): return word + ';' | word + ',' | -sep + sep > value
+        @rule
+        def items(): return item[0:] > value
+
+        self.word = word
+        self.sep = sep
+        self.item = item
+        self.items = items
+
+    def test_selection(self):
+        selection = Generate.MemoSelection(self.items)
+        chosen = set(name for name, is_memo in selection.report if is_memo)
+        self.assertIn(self.word.expand().name, chosen)
+        self.assertIn(self.sep.expand().name, chosen)
+        self.assertNotIn(self.item.expand().name, chosen)
+        self.assertNotIn(self.items.expand().name, chosen)
+
+    def test_report(self):
+        report = memo_report(self.items)
+        self.assertEqual(report, Generate.MemoSelection(self.items).report)
+        self.assertIn((self.word.expand().name, True), report)
+        self.assertIn((self.item.expand().name, False), report)
+        p = self.items(mk_options(memo_select = 'auto'))
+        self.assertEqual(memo_report(p), report)
+        self.assertRaises(Err, memo_report, object())
+
+    def test_build(self):
+        src = 'ab;ba,;aab'
+        expected = self.items().parse(src)
+        options = mk_options(memo_select = 'auto')
+        p = self.items(options)
+        self.assertEqual(p.parse(src), expected)
+        self.assertNotIsInstance(p, Rules.CachingRule)
+        self.assertIsInstance(self.word.parser, Rules.CachingRule)
+        #selection made for items is not used by other grammars
+        @rule
+        def words(): return (self.word + ' ' > first)[0:] > value
+        self.assertEqual(words(options).parse('ab ba '), (6, ['ab', 'ba']))
+        self.assertNotIsInstance(self.word.parser, Rules.CachingRule)
+        self.assertIs(self.items(options), p)
+
+if __name__ == '__main__':
+    unittest.main()
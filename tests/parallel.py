@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import os
+import pickle
+import shutil
+import string
+import tempfile
+import unittest
+from parsed import *
+from parsed import Parallel
+from parsed.cor import Err
+
+
+@rule
+def key(): return char(string.ascii_lowercase)[1:] > list2str
+@rule
+def record(): return key + '=' + digit_dec[1:] + char('\n') \
+    > (lambda x: (x[0], int(list2str(x[1]))))
+@rule
+def records(): return record[0:] + eof > first
+
+def records_count(options):
+    return records(options)
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.items = [('k' * (i % 5 + 1), i) for i in range(3000)]
+        self.data = ''.join('{}={}\n'.format(*x) for x in self.items)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data):
+        path = os.path.join(self.dir, 'data')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_pickle(self):
+        self.assertIs(pickle.loads(pickle.dumps(records)), records)
+        options = mk_options(is_remember = False, action = records_count)
+        restored = pickle.loads(pickle.dumps(options, 2))
+        self.assertEqual(restored, options)
+        self.assertFalse(restored.is_remember)
+        @rule
+        def local(): return key
+        self.assertRaises(pickle.PicklingError, pickle.dumps, local)
+
+    def test_split(self):
+        ranges = Parallel.split(self.data, '\n', 7, window = 16)
+        self.assertEqual(len(ranges), 7)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(self.data))
+        for (b1, e1), (b2, e2) in zip(ranges, ranges[1:]):
+            self.assertEqual(e1, b2)
+            self.assertEqual(self.data[e1 - 1], '\n')
+        self.assertEqual(Parallel.split(self.data, char('\n'), 7,
+                                        window = 16), ranges)
+        self.assertEqual(Parallel.split('a=1', '\n', 3), [(0, 3)])
+        self.assertEqual(Parallel.split('', '\n', 3), [(0, 0)])
+
+    def test_parse(self):
+        path = self.write(self.data)
+        for processes in (1, 3):
+            res = parse_file(path, records, '\n', processes = processes,
+                             chunk_size = 1024)
+            self.assertTrue(len(res) > 3)
+            self.assertEqual(sum(res, []), self.items)
+        res = parse_file(path, records_count, text('\n'), processes = 2,
+                         chunk_size = 4096)
+        self.assertEqual(sum(res, []), self.items)
+        self.assertEqual(parse_file(self.write(''), records, '\n'), [[]])
+
+    def test_error(self):
+        path = self.write(self.data + 'x=y\n' + self.data)
+        self.assertRaises(Err, parse_file, path, records, '\n',
+                          processes = 2, chunk_size = 1024)
+
+if __name__ == '__main__':
+    unittest.main()
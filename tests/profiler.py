@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+from parsed import *
+
+
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def item(): return word + ';' | word + ',' | '(' + items + ')' \
+            > first
+        @rule
+        def items(): return (item + char(' ')[0:] > first)[0:] > value
+        self.items = items
+
+    def stat(self, prof, prefix):
+        found = [x for x in prof.rules.values()
+                 if x.name.startswith(prefix)]
+        self.assertEqual(len(found), 1, found)
+        return found[0]
+
+    def test_rules(self):
+        prof = profile()
+        p = self.items(mk_options(is_stat = prof))
+        self.assertEqual(p.parse('ab, (b; a,)'),
+                         self.items().parse('ab, (b; a,)'))
+        #word alternatives are not tried before '(' and ')'
+        word = self.stat(prof, 'word.')
+        self.assertEqual((word.calls, word.hits, word.matches),
+                         (7, 3, 5))
+        self.assertEqual(word.average_length, 7.0 / 5)
+        total = sum(x.exclusive for x in prof.rules.values())
+        top = self.stat(prof, 'items.')
+        self.assertTrue(abs(top.inclusive - total) < 0.01)
+        self.assertTrue(all(x.inclusive >= x.exclusive >= 0
+                            for x in prof.rules.values()))
+        self.assertEqual(len(prof.report(3).split('\n')), 4)
+
+    def test_export(self):
+        prof = profile()
+        self.items(mk_options(is_stat = prof)).parse('(a (b; (a,)))')
+        stats = pstats.Stats(prof)
+        key = ('parsed', 0, self.stat(prof, 'word.').name)
+        cc, nc, tt, ct, callers = stats.stats[key]
+        self.assertEqual(nc, self.stat(prof, 'word.').calls)
+        self.assertTrue(callers)
+        lines = prof.collapsed().split('\n')
+        self.assertTrue(all(x.rsplit(' ', 1)[1].isdigit() for x in lines))
+        self.assertTrue(any(x.count(';') > 2 for x in lines))
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, 'parse.prof')
+            prof.dump_stats(path)
+            self.assertEqual(pstats.Stats(path).stats, stats.stats)
+        finally:
+            shutil.rmtree(d)
+
+if __name__ == '__main__':
+    unittest.main()
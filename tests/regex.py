@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import unittest
+from parsed import *
+import parsed.Generate as Generate
+import parsed.Rules as Rules
+
+
+class TestFusion(unittest.TestCase):
+
+    def same(self, gen, sources, **kwargs):
+        fused = gen(mk_options(**kwargs))
+        kwargs['use_regex'] = False
+        plain = gen(mk_options(**kwargs))
+        for src in sources:
+            self.assertEqual(fused.parse(src), plain.parse(src), src)
+        return fused
+
+    def test_word(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def item(): return word + ';' | word + ',' | word > value
+        p = self.same(item, ('ab;', 'ba,', 'aab', 'c', ''))
+        self.assertIsInstance(p, Rules.Rule)
+        lexeme = Generate.Lexeme.of(item.expand(), mk_options())
+        self.assertIsInstance(lexeme, Generate.Lexeme)
+        #regular expression is compiled on the first use
+        self.assertIsNone(lexeme.regex)
+        self.assertEqual(lexeme.compile().match('ab;c').end(), 3)
+        self.assertIs(lexeme.compile(), lexeme.regex)
+
+    def test_ranges(self):
+        @rule
+        def digits(): return char('0123')[2:3] > list2str
+        @rule
+        def number(): return -char('-') + digits \
+            + (text('.') + digits)[0:1] > value
+        self.same(number, ('01', '-0123', '012.33', '0', '0.1', '01.'))
+
+    def test_predicates(self):
+        @rule
+        def quoted(): return '"' + (~char('"') + char('ab "') > first)[0:] \
+            + '"' > first
+        @rule
+        def ident(): return ~char('0123456789') \
+            + char('abc0123456789')[0:] > value
+        self.same(quoted, ('"ab c"', '""', '"abc'))
+        self.same(ident, ('ab1', '1ab', 'a'))
+
+    def test_choice(self):
+        @rule
+        def token(): return char('ab')[1:] | text('cd') | char('c')[1:] \
+            > value
+        self.same(token, ('ab', 'cd', 'cc', 'cdc', 'x'))
+
+    def test_unicode(self):
+        @rule
+        def word(): return char(u'ab')[1:] + text(u'c')[0:1] > value
+        self.same(word, (u'abcd', u'bx', u'x'), use_unicode = True)
+
+    def test_capture(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def item(): return capture(word + (',' + word)[0:]) \
+            + span(char(' ')[0:]) > value
+        self.same(item, ('ab,b  x', 'a', ',', ''))
+        self.assertIsInstance(Generate.Lexeme.of(item.expand(), mk_options()),
+                              Generate.Lexeme)
+
+    def test_not_lexical(self):
+        @rule
+        def x(): return char('x') > (lambda v: v.upper())
+        @rule
+        def xs(): return x[1:] > value
+        @rule
+        def nested(): return '(' + nested[0:] + ')' > value
+        self.assertIsNone(Generate.Lexeme.of(xs, mk_options()))
+        self.assertIsNone(Generate.Lexeme.of(nested, mk_options()))
+
+    def test_groups(self):
+        @rule
+        def many(): return reduce(lambda a, b: a | b, [
+            text('x{}'.format(i)) + char('ab')[1:] for i in range(60)]) > value
+        self.assertIsNone(Generate.Lexeme.of(many.expand(), mk_options()))
+        self.same(many, ('x59ab', 'x0b', 'x60a'))
+
+    def test_fallback(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        p = word()
+        self.assertEqual(p.parse(u'ab'), (2, 'ab'))
+        self.assertEqual(p.parse(list('ba')), (2, 'ba'))
+
+if __name__ == '__main__':
+    unittest.main()
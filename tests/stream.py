@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import sys
+import unittest
+from StringIO import StringIO
+from parsed import *
+from parsed.cor import Err
+import parsed.Rules as Rules
+
+
+class TestInput(unittest.TestCase):
+
+    def test_access(self):
+        src = source(iter(['ab', 'cd', 'e']))
+        self.assertEqual(len(src), sys.maxsize)
+        self.assertEqual(src[3], 'd')
+        self.assertEqual(src[1:4], 'bcd')
+        self.assertEqual(src[3:10], 'de')
+        self.assertIs(src[5], empty)
+        self.assertEqual(len(src), 5)
+        self.assertEqual(src[7:9], '')
+
+    def test_limits(self):
+        src = source(StringIO('0123456789'), 2, 6)
+        self.assertEqual(src[0:10], '2345')
+        self.assertIs(src[4], empty)
+        self.assertEqual(len(src), 4)
+        src = Rules.InfiniteInput(StringIO('0123456789'), 3, chunk_size = 2)
+        self.assertEqual(src[0], '3')
+        self.assertEqual(src[6], '9')
+
+    def test_release(self):
+        src = Rules.InfiniteInput(StringIO('0123456789'), chunk_size = 2)
+        src.hold(2)
+        self.assertEqual(src[5], '5')
+        self.assertEqual(src.begin, 2)
+        self.assertEqual(src[2], '2')
+        src.unhold()
+        self.assertEqual(src[8], '8')
+        self.assertEqual(src.begin, 8)
+        self.assertRaises(Err, lambda: src[2])
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def item(): return word + ';' | word + ',' | word > value
+        @rule
+        def items(): return item[0:] > value
+
+        self.items = items
+        self.data = 'ab;ba,aab' * 50
+
+    def test_same_result(self):
+        expected = self.items().parse(self.data)
+        p = self.items(mk_options(is_stream = True))
+        self.assertEqual(p.parse(source(StringIO(self.data))), expected)
+        self.assertEqual(p.parse(source(self.data)), expected)
+        self.assertEqual(p.parse(self.data), expected)
+        self.assertEqual(p.recognize(self.data), len(self.data))
+
+    def test_bounded(self):
+        p = self.items(mk_options(is_stream = True,
+                                  memo = 'window', memo_limit = 16))
+        src = Rules.InfiniteInput(StringIO(self.data), chunk_size = 8)
+        self.assertEqual(p.parse(src)[0], len(self.data))
+        self.assertTrue(src.buffered < 32)
+        self.assertTrue(src.begin > len(self.data) - 32)
+
+    def test_capture(self):
+        #data released by the cut is kept until it is captured
+        @rule
+        def word(): return capture('a' + cut + char('b')[1:]) + ' ' > first
+        @rule
+        def words(): return word[0:] > value
+        data = 'abbbbbbbbb ' * 20
+        p = words(mk_options(is_stream = True))
+        src = Rules.InfiniteInput(StringIO(data), chunk_size = 4)
+        self.assertEqual(p.parse(src), (len(data), ['abbbbbbbbb'] * 20))
+        self.assertTrue(src.begin > len(data) - 16)
+        #plain text source is matched as is
+        self.assertEqual(p.parse(data), (len(data), ['abbbbbbbbb'] * 20))
+        self.assertEqual(p.parse(memoryview(data))[0], len(data))
+
+if __name__ == '__main__':
+    unittest.main()
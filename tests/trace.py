@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2012 Denis Zalevskiy
+# Licensed under MIT License
+
+import gc
+import unittest
+import weakref
+from parsed import *
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        @rule
+        def word(): return char('ab')[1:] > list2str
+        @rule
+        def item(): return spaces + (word | '(' + item[0:] + ')') > first
+        self.item = item
+
+    def test_events(self):
+        t = trace()
+        self.assertEqual(self.item(mk_options(is_trace = t)).parse(' (a)'),
+                         (4, [['a']]))
+        depth, name, pos, res = t.events[0]
+        self.assertEqual((depth, pos, res), (0, 0, (4, [['a']])))
+        self.assertTrue(name.startswith('item'))
+        self.assertTrue(all(x[3] is not None for x in t.events))
+        self.assertEqual(t.depth, 0)
+        lines = t.render(' (a)').split('\n')
+        self.assertEqual(len(lines), len(t.events))
+        self.assertTrue(lines[0].endswith('@0 " (a)" => (4, [[\'a\']])'),
+                        lines[0])
+
+    def test_filters(self):
+        t = trace(3)
+        p = self.item(mk_options(is_trace = t))
+        p.parse('(' * 10 + 'ab' + ')' * 10)
+        self.assertEqual(len(t.events), 3)
+        t = trace(names = ('word',), window = (0, 2))
+        p = self.item(mk_options(is_trace = t))
+        p.parse('a (b)')
+        self.assertTrue(t.events)
+        for depth, name, pos, res in t.events:
+            self.assertTrue(name.startswith('word'), name)
+            self.assertTrue(pos < 2)
+        self.assertFalse(t.render().startswith(' '))
+        t.clear()
+        self.assertEqual(t.render(), '')
+
+    def test_linear(self):
+        t = trace(10)
+        p = self.item(mk_options(is_trace = t))
+        src = '(' + ' a' * 20000 + ')'
+        self.assertEqual(p.parse(src)[0], len(src))
+        self.assertEqual(len(t.events), 10)
+
+    def test_cache(self):
+        #parser built for the previous trace buffer is not kept
+        t = trace()
+        options = mk_options(is_trace = t)
+        p = self.item(options)
+        self.assertIs(self.item(options), p)
+        plain = self.item()
+        seen = weakref.ref(t)
+        del t, p, options
+        t = trace()
+        self.item(mk_options(is_trace = t)).parse('a')
+        gc.collect()
+        self.assertIsNone(seen())
+        self.assertTrue(t.events)
+        self.assertIs(self.item(), plain)
+
+if __name__ == '__main__':
+    unittest.main()